@@ -1,53 +1,2045 @@
 import os
+import sys
+import atexit
+import copy
+import io
+import csv
 import json
 import re
-from datetime import datetime, date
-from flask import Flask, request, jsonify, session
+import hashlib
+import hmac
+import multiprocessing
+import queue
+import random
+import select
+import secrets
+import threading
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date, timezone
+from flask import Flask, Response, g, request, jsonify, session, has_request_context
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
 from flask_cors import CORS
 from flask_session import Session
+from werkzeug.datastructures import CallbackDict
 import psycopg2
-from psycopg2 import errors
+from psycopg2 import errors, sql
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 import traceback
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
-from langchain.chains import LLMChain
-from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
-from langchain_core.messages import SystemMessage
-from langchain.chains.conversation.memory import ConversationBufferWindowMemory
-from langchain_groq import ChatGroq
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 import time
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_login.signals import user_logged_in, user_logged_out
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
 import sqlparse
 from decimal import Decimal
 
+process_start_time = time.perf_counter()  # When this module started importing
+
 # Load environment variables
 load_dotenv('.env.local')
 
+def get_db_config():
+    return {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    }
+
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))  # Workers on this host; gunicorn.conf.py exports it
+
+# Per worker process; see readme.md for how these add up against max_connections
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 4))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 100))  # The server's max_connections
+# Every user has their own role, so each worker keeps whatever its share of max_connections
+# (less superuser_reserved_connections) leaves after the shared pool and the schema feed
+MAX_USER_CONNECTIONS = int(os.getenv(
+    'MAX_USER_CONNECTIONS', max(4, (DB_MAX_CONNECTIONS - 3) // WEB_CONCURRENCY - DB_POOL_MAX - 1)
+))
+
+db_pool = None  # Shared superuser connection pool, created on first use
+db_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises PoolError when exhausted; callers queue here instead
+db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+def get_db_pool():
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = ThreadedConnectionPool(
+                    min(int(os.getenv('DB_POOL_MIN', 1)), DB_POOL_MAX),
+                    DB_POOL_MAX,
+                    **get_db_config()
+                )
+    return db_pool
+
+@contextmanager
+def pooled_connection():
+    pool = get_db_pool()
+    if not db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolError(f"No database connection became free within {DB_POOL_TIMEOUT}s")
+    try:
+        conn = pool.getconn()
+        try:
+            # The connection context manager commits on success and rolls back on error
+            with conn:
+                yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        db_pool_slots.release()
+
+class UserConnectionPool:
+    """Per-process pool of connections authenticated as each user's own role.
+
+    A connection belongs to one request at a time: it is checked out, used inside
+    its own transaction and handed back idle. Idle connections are kept per user
+    (and replica) in LRU order and are the only ones ever closed to make room. At
+    most max_connections are open at once; further checkouts wait up to
+    DB_POOL_TIMEOUT seconds.
+    """
+
+    def __init__(self, connect, max_connections):
+        self.connect = connect
+        self.max_connections = max_connections
+        self.idle = OrderedDict()
+        self.open_connections = 0
+        self._condition = threading.Condition()
+        self.counts = Counter()
+
+    @staticmethod
+    def key(username, replica):
+        return (replica['address'] if replica else None, username)
+
+    def checkout(self, username, replica=None):
+        key = self.key(username, replica)
+        deadline = time.monotonic() + DB_POOL_TIMEOUT
+        with self._condition:
+            while True:
+                idle = self.idle.get(key)
+                if idle:
+                    conn = idle.pop()
+                    if not idle:
+                        del self.idle[key]
+                    if not conn.closed:
+                        self.counts['reused'] += 1
+                        return conn
+                    self.open_connections -= 1
+                    continue
+                if self.open_connections < self.max_connections:
+                    self.open_connections += 1
+                    self.counts['opened'] += 1
+                    break
+                if self.idle:
+                    # Make room by closing the least recently used idle connection
+                    lru_key, connections = next(iter(self.idle.items()))
+                    connections.pop(0).close()
+                    if not connections:
+                        del self.idle[lru_key]
+                    self.open_connections -= 1
+                    self.counts['evicted'] += 1
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError(f"No user connection became free within {DB_POOL_TIMEOUT}s")
+                self._condition.wait(remaining)
+
+        try:
+            return self.connect(username, replica)
+        except Exception:
+            with self._condition:
+                self.open_connections -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn, username, replica=None):
+        key = self.key(username, replica)
+        with self._condition:
+            if conn.closed:
+                self.open_connections -= 1
+            else:
+                self.idle.setdefault(key, []).append(conn)
+                self.idle.move_to_end(key)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, username, replica=None):
+        conn = self.checkout(username, replica)
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn, username, replica)
+
+    def stats(self):
+        with self._condition:
+            checkouts = self.counts['reused'] + self.counts['opened']
+            return {
+                "max_connections": self.max_connections,
+                "open": self.open_connections,
+                "hit_rate": round(self.counts['reused'] / checkouts, 3) if checkouts else None,
+                **self.counts
+            }
+
+    def close_idle(self):
+        with self._condition:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+                    self.open_connections -= 1
+            self.idle.clear()
+            self._condition.notify_all()
+
+DB_REPLICAS = [address.strip() for address in os.getenv('DB_REPLICAS', '').split(',') if address.strip()]  # host[:port], ...
+MAX_REPLICA_LAG_SECONDS = float(os.getenv('MAX_REPLICA_LAG_SECONDS', 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 2))
+# Carries the WAL position of the client's last write. A replica accepted at the lag limit,
+# sampled one interval ago, has replayed anything older than its lifetime
+READ_AFTER_COOKIE = 'read_after_lsn'
+READ_AFTER_COOKIE_SECONDS = int(MAX_REPLICA_LAG_SECONDS + REPLICA_LAG_CHECK_INTERVAL) + 1
+
+# A server that is not in recovery is its own primary: never behind, and its WAL
+# positions aren't comparable with ours (two independent local instances in testing)
+REPLICA_STATUS_QUERY = """
+    SELECT CASE
+               WHEN NOT pg_is_in_recovery() THEN 0
+               WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+               ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+           END AS lag,
+           CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()::TEXT END AS replay_lsn
+"""
+
+def lsn_to_int(lsn):
+    high, _, low = lsn.partition('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+class ReplicaRouter:
+    """Sends read-only lookups to streaming replicas of the primary database.
+
+    Each replica's replay lag and position are sampled at most every
+    REPLICA_LAG_CHECK_INTERVAL seconds, and only replicas within
+    MAX_REPLICA_LAG_SECONDS are used. Callers pass the WAL position of the user's
+    last write; replicas not yet replayed past it are skipped. Reads go to the
+    primary when no replica qualifies or a replica connection fails.
+    """
+
+    def __init__(self, db_config, addresses):
+        self.replicas = []
+        for address in addresses:
+            host, _, port = address.partition(':')
+            self.replicas.append({
+                'address': address,
+                'config': dict(db_config, host=host, port=port or db_config.get('port')),
+                'pool': None,
+                'lag': None,
+                'replay_lsn': None,
+                'checked_at': float('-inf')
+            })
+        self._lock = threading.Lock()
+        self._next = 0
+        self.reads = Counter()
+
+    def get_pool(self, replica):
+        if replica['pool'] is None:
+            with self._lock:
+                if replica['pool'] is None:
+                    replica['pool'] = ThreadedConnectionPool(
+                        0, int(os.getenv('DB_REPLICA_POOL_MAX', 10)), **replica['config']
+                    )
+        return replica['pool']
+
+    def check_lag(self, replica):
+        try:
+            pool = self.get_pool(replica)
+            conn = pool.getconn()
+            try:
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(REPLICA_STATUS_QUERY)
+                        lag, replay_lsn = cur.fetchone()
+            finally:
+                pool.putconn(conn, close=bool(conn.closed))
+            replica['replay_lsn'] = lsn_to_int(replay_lsn) if replay_lsn else None
+            replica['lag'] = float(lag) if lag is not None else None
+        except psycopg2.Error as e:
+            app.logger.warning(f"Replica {replica['address']} is unavailable: {str(e)}")
+            replica['lag'] = None
+
+    def mark_down(self, replica):
+        # Keep it out of rotation until the next lag check
+        replica['lag'] = None
+        replica['checked_at'] = time.monotonic()
+
+    def choose(self, min_lsn=None):
+        """Pick a replica that has replayed min_lsn (None: any, inf: none, use the primary)."""
+        if not self.replicas:
+            return None
+        if min_lsn == float('inf'):
+            self.reads['read_your_writes'] += 1
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            stale = [replica for replica in self.replicas if now - replica['checked_at'] >= REPLICA_LAG_CHECK_INTERVAL]
+            for replica in stale:
+                replica['checked_at'] = now
+        for replica in stale:
+            self.check_lag(replica)
+
+        with self._lock:
+            candidates = [
+                replica for replica in self.replicas
+                if replica['lag'] is not None and replica['lag'] <= MAX_REPLICA_LAG_SECONDS
+            ]
+            if not candidates:
+                self.reads['lagging'] += 1
+                return None
+            if min_lsn is not None:
+                candidates = [
+                    replica for replica in candidates
+                    if replica['replay_lsn'] is None or replica['replay_lsn'] >= min_lsn
+                ]
+                if not candidates:
+                    self.reads['read_your_writes'] += 1
+                    return None
+            self._next += 1
+            return candidates[self._next % len(candidates)]
+
+    @contextmanager
+    def connection(self, min_lsn=None):
+        replica = self.choose(min_lsn)
+        conn = None
+        if replica is not None:
+            pool = self.get_pool(replica)
+            try:
+                conn = pool.getconn()
+            except psycopg2.Error as e:
+                app.logger.warning(f"Falling back to primary, replica {replica['address']} failed: {str(e)}")
+                self.mark_down(replica)
+
+        if conn is None:
+            self.reads['primary'] += 1
+            with pooled_connection() as conn:
+                yield conn
+            return
+
+        self.reads[replica['address']] += 1
+        try:
+            with conn:
+                yield conn
+        except psycopg2.OperationalError:
+            self.mark_down(replica)
+            raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def stats(self):
+        return {
+            "replicas": {replica['address']: replica['lag'] for replica in self.replicas},
+            "reads": dict(self.reads)
+        }
+
+def mark_user_write():
+    # Called wherever a request writes data the user reads back through ReplicaRouter
+    if has_request_context():
+        g.user_wrote = True
+
+def password_method_prefix(method):
+    """The "method:params" prefix Werkzeug stores for hashes made with method, without hashing."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Unsupported password hash method {method!r}")
+
+class PasswordHasherBusyError(RuntimeError):
+    """Raised when the password hashing queue is full; the client should retry later."""
+
+class PasswordHasher:
+    """Runs Werkzeug's password hashing in a pool of worker processes.
+
+    Hashing is deliberately slow, and on request threads it holds the CPU (and the
+    GIL) long enough to stall every other route in the worker. At most queue_depth
+    jobs may be queued or running; beyond that PasswordHasherBusyError is raised
+    so login bursts are shed instead of piling up behind each other. With zero
+    processes the hash runs inline on the calling thread.
+    """
+
+    def __init__(self, method, processes, queue_depth):
+        self.method = method
+        self.processes = processes
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._method_prefix = password_method_prefix(method)
+        self.counts = Counter()
+
+    def get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Spawned, not forked: forking a process with live threads and sockets is unsafe
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def run(self, kind, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.counts['rejected'] += 1
+            raise PasswordHasherBusyError("Too many logins in progress, please retry shortly")
+        self.counts[kind] += 1
+        if self.processes == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self.get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self.run('hashed', generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self.run('verified', check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # Werkzeug stores "method:params$salt$hash"; a plain string comparison, so no hashing here
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def stats(self):
+        return {"method": self.method, "processes": self.processes, **self.counts}
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire after a fixed time-to-live."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        # Move the data to a fresh sid, so a sid planted before login (session fixation)
+        # or seen before logout is worthless; the old one is deleted when the session is saved
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+class MemorySessionInterface(SessionInterface):
+    """Server-side sessions kept in process memory.
+
+    Subclasses override ``_fetch``, ``_persist`` and ``_remove`` to back the
+    in-process cache with a shared store; the cache then acts as a read-through
+    layer so most requests never leave the process.
+    """
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, cache_size=10000, cache_ttl=None):
+        self.cache = TTLCache(cache_size, cache_ttl)
+
+    def _fetch(self, sid):
+        return None
+
+    def _persist(self, sid, data, expires_at):
+        pass
+
+    def _remove(self, sid):
+        pass
+
+    def _cache_ttl(self, app):
+        if self.cache.ttl is not None:
+            return self.cache.ttl
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            item = self.cache.get(sid)
+            if item is None:
+                item = self._fetch(sid)
+                if item is not None:
+                    self.cache.set(sid, item, self._cache_ttl(app))
+            if item is not None:
+                data, expires_at = item
+                if expires_at > datetime.now(timezone.utc):
+                    return ServerSession(data, sid=sid, expires_at=expires_at)
+        # Never reuse a client-supplied sid that we don't know about
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid is not None:
+            self.cache.pop(session.previous_sid)
+            self._remove(session.previous_sid)
+
+        if not session:
+            if not session.new:
+                self.cache.pop(session.sid)
+                self._remove(session.sid)
+            if not session.new or session.previous_sid is not None:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime
+        now = datetime.now(timezone.utc)
+        # Only write when the data changed or the stored expiry is more than half used up
+        needs_refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.new or session.modified or needs_refresh):
+            return
+
+        expires_at = now + lifetime
+        data = dict(session)
+        self.cache.set(session.sid, (data, expires_at), self._cache_ttl(app))
+        self._persist(session.sid, data, expires_at)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+class PostgresSessionInterface(MemorySessionInterface):
+    """Server-side sessions stored in the UNLOGGED ``flask_sessions`` table.
+
+    Every worker and host reads the same table, so the app can run behind a load
+    balancer. The in-process cache TTL bounds how long another host may keep
+    serving a session that was cleared elsewhere.
+    """
+
+    def __init__(self, cache_size=10000, cache_ttl=30, sweep_interval=300, sweep_batch=1000):
+        super().__init__(cache_size, cache_ttl)
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+
+    def _fetch(self, sid):
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT data, expires_at
+                    FROM flask_sessions
+                    WHERE sid = %s AND expires_at > now()
+                """, (sid,))
+                row = cur.fetchone()
+        if row is None:
+            return None
+        return self.serializer.loads(row[0]), row[1]
+
+    def _persist(self, sid, data, expires_at):
+        self._ensure_sweeper()
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO flask_sessions (sid, data, expires_at)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (sid) DO UPDATE
+                    SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+                """, (sid, self.serializer.dumps(data), expires_at))
+
+    def _remove(self, sid):
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM flask_sessions WHERE sid = %s", (sid,))
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep_expired()
+            except Exception as e:
+                app.logger.error(f"Error sweeping expired sessions: {str(e)}")
+
+    def sweep_expired(self):
+        # Delete in small batches so the sweep never holds long locks on the table
+        total = 0
+        while True:
+            with pooled_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM flask_sessions
+                        WHERE sid IN (
+                            SELECT sid FROM flask_sessions
+                            WHERE expires_at <= now()
+                            LIMIT %s
+                        )
+                    """, (self.sweep_batch,))
+                    deleted = cur.rowcount
+            total += deleted
+            if deleted < self.sweep_batch:
+                return total
+
 app = Flask(__name__)
 
-app.config['SESSION_TYPE'] = 'filesystem'
+# 'postgres' (default) shares sessions across workers and hosts, 'memory' keeps them
+# in this process only; any other value is handed to Flask-Session (e.g. 'filesystem').
+app.config['SESSION_TYPE'] = os.getenv('SESSION_TYPE', 'postgres')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', os.urandom(24))
 app.config['SESSION_COOKIE_SECURE'] = False  # Set to True for production with HTTPS
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-Session(app)
+
+if app.config['SESSION_TYPE'] == 'postgres':
+    app.session_interface = PostgresSessionInterface(
+        cache_size=int(os.getenv('SESSION_CACHE_SIZE', 10000)),
+        cache_ttl=int(os.getenv('SESSION_CACHE_TTL', 30)),
+        sweep_interval=int(os.getenv('SESSION_SWEEP_INTERVAL', 300)),
+        sweep_batch=int(os.getenv('SESSION_SWEEP_BATCH', 1000)),
+    )
+elif app.config['SESSION_TYPE'] == 'memory':
+    app.session_interface = MemorySessionInterface(cache_size=int(os.getenv('SESSION_CACHE_SIZE', 10000)))
+else:
+    Session(app)
 
 CORS(app, resources={r"/*": {"origins": "http://127.0.0.1:3000", "supports_credentials": True}})
 
+log_setting_errors = []  # Reported once logging is configured
+
+def parse_log_level(setting, value):
+    # getLevelName maps unknown names to a string, which the level filters can't compare
+    name = value.strip().upper()
+    if name.isdigit():
+        return int(name)
+    level = logging.getLevelName(name)
+    if isinstance(level, int):
+        return level
+    log_setting_errors.append(f"Invalid log level {value!r} in {setting}, using INFO")
+    return logging.INFO
+
+LOG_LEVEL = parse_log_level('LOG_LEVEL', os.getenv('LOG_LEVEL', 'INFO'))
+# Per-endpoint overrides, e.g. "ask=DEBUG,execute_sql=WARNING"
+LOG_ROUTE_LEVELS = {
+    endpoint.strip(): parse_log_level('LOG_ROUTE_LEVELS', level)
+    for endpoint, _, level in (item.partition('=') for item in os.getenv('LOG_ROUTE_LEVELS', '').split(',') if '=' in item)
+}
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_MAX_PAYLOAD = int(os.getenv('LOG_MAX_PAYLOAD', 2000))  # Characters kept of a logged payload
+LOG_MAX_PAYLOAD_ITEMS = int(os.getenv('LOG_MAX_PAYLOAD_ITEMS', 20))  # Rows kept of a logged result set
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.1))  # Share of large payloads logged
+LOG_PAYLOAD_PER_SECOND = int(os.getenv('LOG_PAYLOAD_PER_SECOND', 20))
+LLM_VERBOSE = os.getenv('LLM_VERBOSE', 'false').lower() == 'true'
+
+class LogPayload:
+    """Marks a log argument as a bulky payload: results, prompts, headers, bodies.
+
+    Nothing is rendered when the record is created; the listener thread renders it
+    into at most LOG_MAX_PAYLOAD_ITEMS rows and LOG_MAX_PAYLOAD characters.
+    """
+
+    __slots__ = ('value', 'omitted')
+
+    def __init__(self, value, omitted=0):
+        self.value = value
+        self.omitted = omitted
+
+    def snapshot(self):
+        # Only the rows that will be rendered are copied, so the caller may go on mutating its data
+        value = self.value
+        if isinstance(value, dict):
+            return LogPayload(dict(value))
+        if isinstance(value, (list, tuple)):
+            rows = [dict(row) if isinstance(row, dict) else row for row in value[:LOG_MAX_PAYLOAD_ITEMS]]
+            return LogPayload(rows, self.omitted + len(value) - len(rows))
+        return self
+
+    def is_large(self):
+        if isinstance(self.value, str):
+            return len(self.value) > LOG_MAX_PAYLOAD
+        if isinstance(self.value, (list, tuple, dict)):
+            return len(self.value) + self.omitted > LOG_MAX_PAYLOAD_ITEMS
+        return True
+
+    def __str__(self):
+        value = self.value
+        omitted = self.omitted
+        if isinstance(value, (list, tuple)) and len(value) > LOG_MAX_PAYLOAD_ITEMS:
+            omitted += len(value) - LOG_MAX_PAYLOAD_ITEMS
+            value = value[:LOG_MAX_PAYLOAD_ITEMS]
+        suffix = f" ... [{omitted} more items]" if omitted else ""
+        text = str(value)
+        if len(text) > LOG_MAX_PAYLOAD:
+            suffix = f" ... [{len(text) - LOG_MAX_PAYLOAD} more chars]" + suffix
+            text = text[:LOG_MAX_PAYLOAD]
+        return text + suffix
+
+class RouteLevelFilter(logging.Filter):
+    """Applies LOG_LEVEL, or the LOG_ROUTE_LEVELS entry of the current endpoint, and tags the record with it."""
+
+    def filter(self, record):
+        record.route = request.endpoint if has_request_context() else None
+        return record.levelno >= LOG_ROUTE_LEVELS.get(record.route, LOG_LEVEL)
+
+class PayloadSampler(logging.Filter):
+    """Keeps a sample of large LogPayload arguments, capped at LOG_PAYLOAD_PER_SECOND.
+
+    Records are never dropped; a payload that is not kept is replaced by a marker.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._window = 0
+        self._count = 0
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if not isinstance(record.args, tuple) or not any(isinstance(arg, LogPayload) for arg in record.args):
+            return True
+        record.args = tuple(
+            arg if not isinstance(arg, LogPayload) or not arg.is_large() or self.keep() else "<payload sampled out>"
+            for arg in record.args
+        )
+        return True
+
+    def keep(self):
+        if random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+            self.sampled_out += 1
+            return False
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window, self._count = window, 0
+            if self._count >= LOG_PAYLOAD_PER_SECOND:
+                self.sampled_out += 1
+                return False
+            self._count += 1
+        return True
+
+class DeferredQueueHandler(QueueHandler):
+    """Hands records to the listener thread without formatting them on the caller's thread.
+
+    The stock QueueHandler renders the message before enqueueing; here that work
+    happens in the listener. prepare only copies the record, snapshots LogPayload
+    arguments down to the rows that will be rendered and renders the traceback, so
+    nothing the caller later mutates or frees is read from another thread. When the
+    queue is full the record is dropped and counted rather than blocking the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(arg.snapshot() if isinstance(arg, LogPayload) else arg for arg in record.args)
+        if record.exc_info:
+            # Like QueueHandler: keep the text, drop the traceback and the frames it holds alive
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JSONLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "route": getattr(record, 'route', None),
+            "process": record.process,
+            "thread": record.threadName
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+def configure_logging():
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RouteLevelFilter())
+    payload_sampler = PayloadSampler()
+    queue_handler.addFilter(payload_sampler)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JSONLogFormatter())
+    listener = QueueListener(log_queue, stream_handler)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    # Loggers must let through the most verbose level any route asks for; the filter does the rest
+    root.setLevel(min([LOG_LEVEL, *LOG_ROUTE_LEVELS.values()]))
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler, payload_sampler
+
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+log_handler, payload_sampler = configure_logging()
 logger = logging.getLogger(__name__)
+for error in log_setting_errors:
+    logger.warning(error)
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+@user_logged_in.connect
+@user_logged_out.connect
+def regenerate_session_id(sender, user, **extra):
+    # Only the server-side interfaces above can rotate; Flask-Session backends keep their sid
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+
 wrapper = None  # Global wrapper instance
 
 MAX_TABLES_PER_USER = 10  # Set the maximum number of tables a user can create
 
+# Bump PROVISIONING_VERSION whenever USER_PROVISIONING_TEMPLATE changes; existing users
+# are upgraded in the background on their next login.
+PROVISIONING_VERSION = 1
+USER_PROVISIONING_TEMPLATE = [
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.sample_users (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100),
+        email VARCHAR(100),
+        age INTEGER,
+        city VARCHAR(100),
+        registration_date DATE
+    )
+    """,
+    "ALTER TABLE {schema}.sample_users ENABLE ROW LEVEL SECURITY",
+    "DROP POLICY IF EXISTS user_{username}_own_data_policy ON {schema}.sample_users",
+    """
+    CREATE POLICY user_{username}_own_data_policy ON {schema}.sample_users
+    FOR ALL
+    USING (current_user = '{username}')
+    """,
+    """
+    INSERT INTO {schema}.sample_users (name, email, age, city, registration_date)
+    SELECT * FROM (VALUES
+        ('Alice Smith', 'alice@example.com', 28, 'New York', '2023-01-15'::DATE),
+        ('Bob Johnson', 'bob@example.com', 35, 'Los Angeles', '2023-02-20'::DATE),
+        ('Charlie Brown', 'charlie@example.com', 42, 'Chicago', '2023-03-10'::DATE),
+        ('Diana Davis', 'diana@example.com', 31, 'Houston', '2023-04-05'::DATE),
+        ('Eva Wilson', 'eva@example.com', 39, 'Phoenix', '2023-05-22'::DATE)
+    ) AS new_data(name, email, age, city, registration_date)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {schema}.sample_users LIMIT 1
+    )
+    """,
+]
+
+# Authenticated identities, so @login_required requests don't query the users table
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+    ttl=int(os.getenv('USER_CACHE_TTL', 300))
+)
+
+# Every worker on the host has its own pool, so split the cores and the host-wide queue
+# bound between them
+PASSWORD_HASH_PROCESSES = int(os.getenv('PASSWORD_HASH_PROCESSES', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', (os.cpu_count() or 1) * 4))
+password_hasher = PasswordHasher(
+    method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt'),  # Any werkzeug method, e.g. 'pbkdf2:sha256:600000'
+    processes=PASSWORD_HASH_PROCESSES,
+    queue_depth=max(1, PASSWORD_HASH_QUEUE_DEPTH // WEB_CONCURRENCY)
+)
+
+# Template datasets are generated once per size into a dataset_<name>_<size> schema and
+# then shared with users as read-only views or cloned into their own schema.
+# Table statements are formatted with {table}, {rows}, {dim_rows} and {small_rows}.
+DATASET_SIZES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+MAX_CLONE_ROWS = int(os.getenv('DATASET_MAX_CLONE_ROWS', 1_000_000))  # Larger datasets are shared only
+
+DATASET_CATALOG = {
+    'ecommerce': {
+        'description': "Customers, products and orders of an online store",
+        'tables': [
+            ('customers', """
+                CREATE TABLE {table} AS
+                SELECT g AS id,
+                       'Customer ' || g AS name,
+                       'customer' || g || '@example.com' AS email,
+                       (ARRAY['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix', 'Seattle', 'Denver', 'Boston'])[1 + floor(random() * 8)::INT] AS city,
+                       DATE '2020-01-01' + floor(random() * 1460)::INT AS signup_date
+                FROM generate_series(1, {dim_rows}) AS g
+            """),
+            ('products', """
+                CREATE TABLE {table} AS
+                SELECT g AS id,
+                       'Product ' || g AS name,
+                       (ARRAY['Books', 'Electronics', 'Garden', 'Grocery', 'Sports', 'Toys'])[1 + floor(random() * 6)::INT] AS category,
+                       round((1 + random() * 499)::NUMERIC, 2) AS price
+                FROM generate_series(1, {small_rows}) AS g
+            """),
+            ('orders', """
+                CREATE TABLE {table} AS
+                SELECT g AS id,
+                       1 + floor(random() * {dim_rows})::INT AS customer_id,
+                       1 + floor(random() * {small_rows})::INT AS product_id,
+                       1 + floor(random() * 5)::INT AS quantity,
+                       (ARRAY['pending', 'shipped', 'delivered', 'returned'])[1 + floor(random() * 4)::INT] AS status,
+                       TIMESTAMP '2022-01-01' + random() * INTERVAL '730 days' AS ordered_at
+                FROM generate_series(1, {rows}) AS g
+            """),
+        ],
+    },
+    'hr': {
+        'description': "Departments and employees with salaries and reporting lines",
+        'tables': [
+            ('departments', """
+                CREATE TABLE {table} AS
+                SELECT g AS id, name
+                FROM unnest(ARRAY['Engineering', 'Sales', 'Marketing', 'Finance', 'Support', 'Legal',
+                                  'Operations', 'Research', 'Design', 'People']) WITH ORDINALITY AS d(name, g)
+            """),
+            ('employees', """
+                CREATE TABLE {table} AS
+                SELECT g AS id,
+                       'Employee ' || g AS name,
+                       1 + floor(random() * 10)::INT AS department_id,
+                       CASE WHEN g > 10 THEN 1 + floor(random() * least(g - 1, {dim_rows}))::INT END AS manager_id,
+                       (ARRAY['Associate', 'Analyst', 'Engineer', 'Manager', 'Director'])[1 + floor(random() * 5)::INT] AS title,
+                       round((40000 + random() * 160000)::NUMERIC, 2) AS salary,
+                       DATE '2010-01-01' + floor(random() * 5000)::INT AS hire_date
+                FROM generate_series(1, {rows}) AS g
+            """),
+        ],
+    },
+    'events': {
+        'description': "Product analytics events emitted by app users",
+        'tables': [
+            ('events', """
+                CREATE TABLE {table} AS
+                SELECT g AS id,
+                       1 + floor(random() * {dim_rows})::INT AS user_id,
+                       (ARRAY['page_view', 'click', 'signup', 'purchase', 'logout'])[1 + floor(random() * 5)::INT] AS event_type,
+                       (ARRAY['web', 'ios', 'android'])[1 + floor(random() * 3)::INT] AS device,
+                       floor(random() * 60000)::INT AS duration_ms,
+                       TIMESTAMP '2024-01-01' + random() * INTERVAL '365 days' AS occurred_at
+                FROM generate_series(1, {rows}) AS g
+            """),
+        ],
+    },
+}
+
+MAX_IMPORT_BYTES = int(os.getenv('MAX_IMPORT_BYTES', 100 * 1024 * 1024))  # Per uploaded file
+IMPORT_FORM_OVERHEAD_BYTES = 64 * 1024  # Multipart boundaries and form fields around the file
+# Werkzeug refuses larger bodies outright instead of spooling them to disk before /import sees them
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMPORT_BYTES + IMPORT_FORM_OVERHEAD_BYTES
+USER_SCHEMA_QUOTA_BYTES = int(os.getenv('USER_SCHEMA_QUOTA_BYTES', 500 * 1024 * 1024))  # Per user schema
+IMPORT_SAMPLE_BYTES = 64 * 1024  # Leading bytes of a CSV used for type inference
+
+class QuotaExceededError(ValueError):
+    pass
+
+class QuotaReader:
+    """Binary file-like object that replays a buffered prefix, then streams the rest.
+
+    COPY pulls data through ``read`` in small chunks, so the upload is never held
+    in memory; reading past ``limit`` bytes aborts the COPY. psycopg2 reports any
+    error raised by ``read`` as QueryCanceled, so ``exceeded`` records the cause.
+    """
+
+    def __init__(self, prefix, stream, limit):
+        self.prefix = prefix
+        self.stream = stream
+        self.limit = limit
+        self.bytes_read = 0
+        self.exceeded = False
+
+    def read(self, size=-1):
+        if self.prefix:
+            if size is None or size < 0:
+                chunk, self.prefix = self.prefix + self.stream.read(), b''
+            else:
+                chunk, self.prefix = self.prefix[:size], self.prefix[size:]
+        else:
+            chunk = self.stream.read(size)
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.limit:
+            self.exceeded = True
+            raise QuotaExceededError(f"Upload exceeds the {self.limit} byte import quota")
+        return chunk
+
+def sanitize_identifier(name, fallback):
+    identifier = re.sub(r'[^a-z0-9_]+', '_', str(name).strip().lower()).strip('_')[:63]
+    if not identifier:
+        identifier = fallback
+    if not identifier[0].isalpha():
+        identifier = f"c_{identifier}"[:63]
+    return identifier
+
+def infer_csv_column_type(values):
+    values = [value for value in values if value != '']
+    if not values:
+        return 'TEXT'
+
+    def all_parse(parser):
+        try:
+            for value in values:
+                parser(value)
+            return True
+        except ValueError:
+            return False
+
+    def parse_bool(value):
+        if value.lower() not in ('true', 'false', 't', 'f'):
+            raise ValueError(value)
+
+    if all_parse(int):
+        return 'BIGINT'
+    if all_parse(float):
+        return 'DOUBLE PRECISION'
+    if all_parse(parse_bool):
+        return 'BOOLEAN'
+    if all_parse(date.fromisoformat):
+        return 'DATE'
+    if all_parse(datetime.fromisoformat):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+def arrow_type_to_postgres(arrow_type):
+    import pyarrow as pa
+
+    if pa.types.is_boolean(arrow_type):
+        return 'BOOLEAN'
+    if pa.types.is_integer(arrow_type):
+        return 'BIGINT'
+    if pa.types.is_floating(arrow_type):
+        return 'DOUBLE PRECISION'
+    if pa.types.is_decimal(arrow_type):
+        return 'NUMERIC'
+    if pa.types.is_date(arrow_type):
+        return 'DATE'
+    if pa.types.is_timestamp(arrow_type):
+        return 'TIMESTAMPTZ' if arrow_type.tz else 'TIMESTAMP'
+    return 'TEXT'
+
+EXPORT_PARQUET_BATCH_ROWS = int(os.getenv('EXPORT_PARQUET_BATCH_ROWS', 50000))
+EXPORT_CSV_BATCH_ROWS = int(os.getenv('EXPORT_CSV_BATCH_ROWS', 5000))
+
+class ExportCancelled(Exception):
+    pass
+
+class QueueWriter:
+    """Write-only file object that hands chunks to a consumer thread through a bounded queue.
+
+    The producer blocks once ``maxsize`` chunks are waiting, so memory use does not
+    depend on the size of the export. ``cancel`` makes pending and future writes
+    fail, which aborts the producer when the client goes away.
+    """
+    _done = object()
+
+    def __init__(self, maxsize=16):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.cancelled = threading.Event()
+        self.error = None
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled("Export cancelled by the client")
+            try:
+                self.queue.put(data, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def finish(self, error=None):
+        self.error = error
+        self.closed = True
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(self._done, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def __iter__(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is self._done:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield chunk
+
+def export_text(value):
+    # Text form of a value with no native Arrow/CSV mapping; never raises, whatever the type
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=export_text)
+    return str(value)
+
+def postgres_type_to_arrow(type_code, precision=None, scale=None):
+    import pyarrow as pa
+
+    if type_code == 16:
+        return pa.bool_(), None
+    if type_code == 17:
+        return pa.binary(), bytes
+    if type_code in (20, 21, 23):
+        return pa.int64(), None
+    if type_code in (700, 701):
+        return pa.float64(), None
+    if type_code == 1700 and precision is not None and 0 < precision <= 38:
+        # NaN and infinity have no decimal128 form
+        return pa.decimal128(precision, scale or 0), lambda value: value if value.is_finite() else None
+    if type_code == 1082:
+        return pa.date32(), None
+    if type_code == 1083:
+        return pa.time64('us'), None
+    if type_code == 1114:
+        return pa.timestamp('us'), None
+    if type_code == 1184:
+        return pa.timestamp('us', tz='UTC'), None
+    # Unconstrained numeric stays exact as text rather than rounding through float64
+    return pa.string(), export_text
+
+def export_statement(query):
+    """Return query as a single bare SELECT (or WITH ... SELECT), safe to declare a cursor for."""
+    query = sqlparse.format(query, strip_comments=True).strip()
+    statements = [stmt.strip().rstrip(';').strip() for stmt in sqlparse.split(query)]
+    statements = [stmt for stmt in statements if stmt]
+    if len(statements) != 1 or sqlparse.parse(statements[0])[0].get_type() != 'SELECT':
+        raise ValueError("Export requires exactly one SELECT statement")
+    return statements[0]
+
+SCRIPT_BATCH_SIZE = int(os.getenv('SCRIPT_BATCH_SIZE', 50))  # Statements per round trip in script mode
+# Leading words of statements that would end or escape the script's savepoints;
+# COMMIT PREPARED and ROLLBACK PREPARED are caught by their first word
+SCRIPT_TRANSACTION_KEYWORDS = {
+    'ABORT', 'BEGIN', 'START', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PREPARE TRANSACTION'
+}
+
+def is_transaction_control(stmt):
+    words = re.findall(r'[A-Z_]+', sqlparse.format(stmt, strip_comments=True).upper())[:2]
+    return bool(words) and (words[0] in SCRIPT_TRANSACTION_KEYWORDS or ' '.join(words) in SCRIPT_TRANSACTION_KEYWORDS)
+
+# Versioned schema migrations, applied in order by LLMSQLWrapper.run_migrations.
+# Never edit a released migration; append a new one instead.
+MIGRATIONS = [
+    (1, "baseline schema", """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS query_history (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            query_definition TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            results JSONB
+        );
+
+        CREATE TABLE IF NOT EXISTS question_history (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            category VARCHAR,
+            question TEXT,
+            tables TEXT,
+            hint TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS submission_history (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            question_id BIGINT,
+            correctness_score INT,
+            efficiency_score INT,
+            style_score INT,
+            overall_feedback TEXT,
+            pass_fail BOOLEAN,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- Enable Row Level Security
+        ALTER TABLE query_history ENABLE ROW LEVEL SECURITY;
+        ALTER TABLE question_history ENABLE ROW LEVEL SECURITY;
+        ALTER TABLE submission_history ENABLE ROW LEVEL SECURITY;
+
+        -- Create policies if they don't exist
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_policies 
+                WHERE tablename = 'query_history' AND policyname = 'query_history_isolation_policy'
+            ) THEN
+                CREATE POLICY query_history_isolation_policy ON query_history
+                    USING (user_id = current_setting('app.current_user_id')::INTEGER);
+            END IF;
+
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_policies 
+                WHERE tablename = 'question_history' AND policyname = 'question_history_isolation_policy'
+            ) THEN
+                CREATE POLICY question_history_isolation_policy ON question_history
+                    USING (user_id = current_setting('app.current_user_id')::INTEGER);
+            END IF;
+
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_policies 
+                WHERE tablename = 'submission_history' AND policyname = 'submission_history_isolation_policy'
+            ) THEN
+                CREATE POLICY submission_history_isolation_policy ON submission_history
+                    USING (user_id = current_setting('app.current_user_id')::INTEGER);
+            END IF;
+        END
+        $$;
+
+        -- Function to set current user
+        CREATE OR REPLACE FUNCTION set_current_user(p_user_id INTEGER)
+        RETURNS VOID AS $$
+        BEGIN
+            PERFORM set_config('app.current_user_id', p_user_id::TEXT, FALSE);
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- Sample public dataset
+        CREATE TABLE IF NOT EXISTS public.sample_dataset (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100),
+            value INTEGER
+        );
+
+        GRANT SELECT ON public.sample_dataset TO PUBLIC;
+    """),
+    (2, "server-side session store", """
+        -- Server-side session store; UNLOGGED skips WAL since sessions are disposable
+        CREATE UNLOGGED TABLE IF NOT EXISTS flask_sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS flask_sessions_expires_at_idx ON flask_sessions (expires_at);
+    """),
+    (3, "user provisioning version", """
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS provisioned_version INTEGER NOT NULL DEFAULT 0;
+    """),
+    (4, "dataset catalog", """
+        -- Template datasets that have been generated and can be attached by users
+        CREATE TABLE IF NOT EXISTS dataset_catalog (
+            dataset VARCHAR(50) NOT NULL,
+            size_label VARCHAR(10) NOT NULL,
+            schema_name VARCHAR(63) NOT NULL,
+            row_count BIGINT NOT NULL,
+            built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (dataset, size_label)
+        );
+    """),
+    (5, "derived role passwords and shared chat memory", """
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS role_password_derived BOOLEAN NOT NULL DEFAULT FALSE;
+
+        -- Chat memory lives in the database so every worker sees the same conversation
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            role VARCHAR(10) NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE INDEX IF NOT EXISTS chat_messages_user_id_idx ON chat_messages (user_id, id);
+    """),
+    (6, "shared table change tracking", """
+        -- Version counters for shared relations; the result cache compares them to detect changes
+        CREATE TABLE IF NOT EXISTS shared_table_versions (
+            relation TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+
+        CREATE OR REPLACE FUNCTION bump_shared_table_version()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO shared_table_versions (relation, version)
+            VALUES (TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME, 1)
+            ON CONFLICT (relation) DO UPDATE SET version = shared_table_versions.version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS sample_dataset_version ON public.sample_dataset;
+        CREATE TRIGGER sample_dataset_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.sample_dataset
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_shared_table_version();
+
+        INSERT INTO shared_table_versions (relation) VALUES ('public.sample_dataset')
+        ON CONFLICT (relation) DO NOTHING;
+    """),
+    (7, "user schema change feed", """
+        -- Publish table-level DDL in user schemas on the user_schema_changes channel
+        CREATE OR REPLACE FUNCTION notify_user_schema_ddl()
+        RETURNS event_trigger AS $$
+        DECLARE
+            obj RECORD;
+        BEGIN
+            FOR obj IN
+                SELECT * FROM pg_event_trigger_ddl_commands()
+                WHERE schema_name LIKE 'user\\_%' AND object_type IN ('table', 'view', 'materialized view')
+            LOOP
+                PERFORM pg_notify('user_schema_changes', json_build_object(
+                    'op', CASE WHEN obj.command_tag LIKE 'CREATE%' OR obj.command_tag = 'SELECT INTO'
+                               THEN 'created' ELSE 'altered' END,
+                    'schema', obj.schema_name,
+                    'table', (SELECT relname FROM pg_class WHERE oid = obj.objid)
+                )::TEXT);
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE FUNCTION notify_user_schema_drop()
+        RETURNS event_trigger AS $$
+        DECLARE
+            obj RECORD;
+        BEGIN
+            FOR obj IN
+                SELECT * FROM pg_event_trigger_dropped_objects()
+                WHERE original AND schema_name LIKE 'user\\_%' AND object_type IN ('table', 'view', 'materialized view')
+            LOOP
+                PERFORM pg_notify('user_schema_changes', json_build_object(
+                    'op', 'dropped',
+                    'schema', obj.schema_name,
+                    'table', obj.object_name
+                )::TEXT);
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP EVENT TRIGGER IF EXISTS user_schema_ddl;
+        CREATE EVENT TRIGGER user_schema_ddl ON ddl_command_end
+            EXECUTE FUNCTION notify_user_schema_ddl();
+
+        DROP EVENT TRIGGER IF EXISTS user_schema_drop;
+        CREATE EVENT TRIGGER user_schema_drop ON sql_drop
+            EXECUTE FUNCTION notify_user_schema_drop();
+    """),
+    (8, "users.last_write_lsn", """
+        -- WAL position after the user's latest write, for read-your-writes on replicas
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_write_lsn pg_lsn;
+    """),
+    (9, "drop users.last_write_lsn", """
+        -- Superseded by the read_after_lsn cookie, which needs no primary lookup per read
+        ALTER TABLE users DROP COLUMN IF EXISTS last_write_lsn;
+    """),
+]
+
+RESULT_CACHE_BYTES = int(os.getenv('RESULT_CACHE_BYTES', 0))  # 0 disables the shared result cache
+# Functions whose result differs between calls or users; plans that use them are never cached
+VOLATILE_FUNCTION_PATTERN = re.compile(
+    r'\b(random|setseed|now|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday|'
+    r'current_(date|time|timestamp|user|role|schema|schemas|setting)|localtime|localtimestamp|'
+    r'session_user|user|nextval|currval|lastval|setval|gen_random_uuid|uuid_generate_\w+|txid_\w+|pg_\w+)\b',
+    re.IGNORECASE
+)
+# Names in EXPLAIN VERBOSE expressions that may resolve to objects outside pg_catalog.
+# Plans print objects on the search_path unqualified, so the same text can mean
+# different users' functions, operators or types.
+PLAN_FUNCTION_PATTERN = re.compile(r'(?:"((?:[^"]|"")+)"|([A-Za-z_][\w$]*))\s*\(')
+PLAN_TYPE_PATTERN = re.compile(r'::\s*(?:"((?:[^"]|"")+)"|([A-Za-z_][\w$]*))')
+PLAN_OPERATOR_PATTERN = re.compile(r'[+\-*/<>=~!@#%^&|`?]+')
+
+def normalize_sql(statement):
+    formatted = sqlparse.format(statement, strip_comments=True, keyword_case='upper')
+    return re.sub(r'\s+', ' ', formatted).strip().rstrip(';').strip()
+
+class ResultCache:
+    """Byte-bounded LRU of read-only query results over shared relations.
+
+    Entries are keyed by the query plan, so two users share an entry only when
+    their statements resolve to exactly the same relations and expressions.
+    Each entry remembers the shared_table_versions it was computed from and
+    is dropped as soon as any of them moves on. Plans are memoised per user
+    and normalized SQL so that a hit does not touch the database at all.
+    """
+
+    def __init__(self, max_bytes, version_ttl=1.0, plan_ttl=300, max_plans_per_user=200):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 10
+        self.version_ttl = version_ttl
+        self.plan_ttl = plan_ttl
+        self.max_plans_per_user = max_plans_per_user
+        self.entries = OrderedDict()
+        self.plans = {}
+        self.current_bytes = 0
+        self.versions = {}
+        self.versions_fetched_at = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def table_versions(self, fetch):
+        # Polled at most once per version_ttl, so writes become visible within that window
+        if time.monotonic() - self.versions_fetched_at > self.version_ttl:
+            versions = fetch()
+            with self._lock:
+                self.versions = versions
+                self.versions_fetched_at = time.monotonic()
+        return self.versions
+
+    def get_plan(self, username, sql_key):
+        with self._lock:
+            plan = self.plans.get(username, {}).get(sql_key)
+        if plan is None or plan[2] <= time.monotonic():
+            return None
+        return plan[:2]
+
+    def set_plan(self, username, sql_key, plan_key, relations):
+        with self._lock:
+            user_plans = self.plans.setdefault(username, OrderedDict())
+            user_plans[sql_key] = (plan_key, relations, time.monotonic() + self.plan_ttl)
+            while len(user_plans) > self.max_plans_per_user:
+                user_plans.popitem(last=False)
+
+    def forget_user(self, username):
+        # The user's DDL can change what their unqualified table names resolve to
+        with self._lock:
+            self.plans.pop(username, None)
+
+    def get(self, plan_key, versions):
+        with self._lock:
+            entry = self.entries.get(plan_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            results, entry_versions, size = entry
+            if any(versions.get(relation) != version for relation, version in entry_versions.items()):
+                del self.entries[plan_key]
+                self.current_bytes -= size
+                self.misses += 1
+                return None
+            self.entries.move_to_end(plan_key)
+            self.hits += 1
+            return results
+
+    def put(self, plan_key, results, entry_versions):
+        size = len(json.dumps(results, cls=CustomJSONEncoder))
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self.entries.pop(plan_key, None)
+            if previous is not None:
+                self.current_bytes -= previous[2]
+            self.entries[plan_key] = (results, entry_versions, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+SCHEMA_FEED_CHANNEL = 'user_schema_changes'
+SCHEMA_FEED_HEARTBEAT = 15  # Seconds between SSE keep-alive comments
+# Every open stream holds a worker thread; leave the rest of the gthread pool for other routes
+SCHEMA_STREAMS_PER_WORKER = int(os.getenv('SCHEMA_STREAMS_PER_WORKER', max(1, int(os.getenv('GUNICORN_THREADS', 4)) // 2)))
+SCHEMA_STREAM_MAX_SECONDS = int(os.getenv('SCHEMA_STREAM_MAX_SECONDS', 1800))  # Clients reconnect after this
+schema_stream_slots = threading.BoundedSemaphore(SCHEMA_STREAMS_PER_WORKER)
+
+class SchemaChangeFeed:
+    """Fans out DDL notifications from Postgres to per-user subscriber queues.
+
+    One LISTEN connection per process receives every change made in a user_*
+    schema, looks up the affected table's columns once and hands the same
+    delta to all of that user's open streams.
+    """
+
+    def __init__(self, db_config, describe_table, on_change=None, queue_size=100):
+        self.db_config = db_config
+        self.describe_table = describe_table
+        self.on_change = on_change
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen_loop, name="schema-feed", daemon=True)
+                self._thread.start()
+
+    def subscribe(self, username):
+        self.start()
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self.subscribers.setdefault(username, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, username, subscriber):
+        with self._lock:
+            user_subscribers = self.subscribers.get(username)
+            if user_subscribers is not None:
+                user_subscribers.discard(subscriber)
+                if not user_subscribers:
+                    del self.subscribers[username]
+
+    def publish(self, username, delta):
+        with self._lock:
+            user_subscribers = list(self.subscribers.get(username, ()))
+        for subscriber in user_subscribers:
+            try:
+                subscriber.put_nowait(delta)
+            except queue.Full:
+                # A stalled client missed deltas; tell it to refetch the whole schema
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait({"op": "resync"})
+
+    def _listen_loop(self):
+        backoff = 1
+        while True:
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {SCHEMA_FEED_CHANNEL}")
+                backoff = 1
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        try:
+                            self._handle(payload)
+                        except Exception as e:
+                            # Keep listening; a failed lookup must not cost the other notifications
+                            app.logger.error(f"Error handling schema change {payload}: {str(e)}")
+            except Exception as e:
+                app.logger.error(f"Schema change feed connection lost: {str(e)}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _handle(self, payload):
+        change = json.loads(payload)
+        schema_name, table_name = change['schema'], change['table']
+        username = schema_name[len('user_'):]
+        if self.on_change:
+            self.on_change(username)
+        with self._lock:
+            if username not in self.subscribers:
+                return
+        delta = {"op": change['op'], "schema": schema_name, "table": table_name}
+        if change['op'] != 'dropped':
+            try:
+                delta["item"] = self.describe_table(schema_name, table_name)
+            except Exception:
+                self.publish(username, {"op": "resync"})
+                raise
+        self.publish(username, delta)
+
+# Expected fields of structured LLM replies; *_score fields must be integers from 0 to 10
+PRACTICE_QUESTION_FIELDS = {
+    'question': str,
+    'category': str,
+    'tables': str,
+    'hint': str,
+}
+SOLUTION_FEEDBACK_FIELDS = {
+    'correctness_score': int,
+    'correctness': str,
+    'efficiency_score': int,
+    'efficiency': str,
+    'style_score': int,
+    'style': str,
+    'overall_feedback': str,
+    'improvement_suggestions': list,
+}
+
+llm_parse_stats = defaultdict(Counter)  # Per output kind: strict, repaired, invalid, reasked, failed
+
+class LLMOutputError(RuntimeError):
+    """The model's reply could not be used, even after repairs; not the client's fault."""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+def structured_output_errors(data, fields):
+    if not isinstance(data, dict):
+        return ["reply must be a JSON object"]
+    problems = []
+    for name, expected in fields.items():
+        value = data.get(name)
+        if value is None:
+            problems.append(f"missing field '{name}'")
+        elif expected is int and (isinstance(value, bool) or not isinstance(value, int)):
+            problems.append(f"'{name}' must be an integer")
+        elif not isinstance(value, expected):
+            problems.append(f"'{name}' must be a {'string' if expected is str else 'list'}")
+        elif name.endswith('_score') and not 0 <= value <= 10:
+            problems.append(f"'{name}' must be between 0 and 10")
+    return problems
+
+def extract_json_object(text):
+    # Models like to wrap JSON in code fences or prose, and to leave trailing commas
+    text = re.sub(r'```(?:json)?', '', text)
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    candidate = text[start:end + 1]
+    for attempt in (candidate, re.sub(r',\s*([}\]])', r'\1', candidate.replace('\u201c', '"').replace('\u201d', '"'))):
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            continue
+    return None
+
+def coerce_structured(data, fields):
+    if not isinstance(data, dict):
+        return data
+    coerced = {key.strip().lower().replace(' ', '_'): value for key, value in data.items()}
+    for name, expected in fields.items():
+        value = coerced.get(name)
+        if value is None:
+            continue
+        if expected is int and not isinstance(value, int):
+            match = re.search(r'-?\d+(?:\.\d+)?', str(value))  # "8", 8.0 and "8/10" all become 8
+            coerced[name] = round(float(match.group(0))) if match else value
+        elif expected is str and not isinstance(value, str):
+            coerced[name] = ", ".join(map(str, value)) if isinstance(value, list) else str(value)
+        elif expected is list and not isinstance(value, list):
+            coerced[name] = [line.strip().lstrip('-*• ').strip() for line in str(value).splitlines() if line.strip()]
+    return coerced
+
+def parse_structured_output(text, fields, kind, lenient_extract=None):
+    """Parse a JSON reply strictly, then with local repairs, before giving up."""
+    stats = llm_parse_stats[kind]
+    try:
+        data = json.loads(text)
+        if not structured_output_errors(data, fields):
+            stats['strict'] += 1
+            return data
+    except ValueError:
+        pass
+
+    problems = ["reply did not contain a JSON object"]
+    candidate = extract_json_object(text)
+    if candidate is not None:
+        data = coerce_structured(candidate, fields)
+        problems = structured_output_errors(data, fields)
+        if not problems:
+            stats['repaired'] += 1
+            return data
+
+    # Braces in a legacy-layout reply (e.g. SQL or JSON in a question) aren't the answer object
+    legacy = lenient_extract(text) if lenient_extract is not None else None
+    if legacy is not None:
+        data = coerce_structured(legacy, fields)
+        if not structured_output_errors(data, fields):
+            stats['repaired'] += 1
+            return data
+
+    stats['invalid'] += 1
+    raise LLMOutputError(problems)
+
+def extract_practice_question_text(text):
+    # Replies in the older "Question: ... Tables: ..." layout
+    sections = {}
+    for name in PRACTICE_QUESTION_FIELDS:
+        match = re.search(rf'{name}:\s*(.+?)\s*(?=\n\s*(?:Question|Category|Tables|Hint):|$)', text, re.IGNORECASE | re.DOTALL)
+        if match:
+            sections[name] = match.group(1).strip()
+    return sections or None
+
+def extract_solution_feedback_text(text):
+    # Replies in the older "Correctness (X/10): ..." layout
+    sections = {}
+    for name in ('correctness', 'efficiency', 'style'):
+        match = re.search(rf'{name}\s*\((\d+)\s*/\s*10\)\s*:?\s*(.*)', text, re.IGNORECASE)
+        if match:
+            sections[f'{name}_score'] = int(match.group(1))
+            sections[name] = match.group(2).strip()
+    overall = re.search(r'Overall feedback:\s*(.+?)(?=\n\n|$)', text, re.IGNORECASE | re.DOTALL)
+    if overall:
+        sections['overall_feedback'] = overall.group(1).strip()
+    suggestions = re.search(r'Improvement suggestions:\s*(.+)', text, re.IGNORECASE | re.DOTALL)
+    sections['improvement_suggestions'] = suggestions.group(1) if suggestions else []
+    return sections if len(sections) > 1 else None
+
+DUCKDB_DIR = os.getenv('DUCKDB_DIR', 'duckdb_sandboxes')
+DUCKDB_DATASET_SIZE = os.getenv('DUCKDB_DATASET_SIZE', '1m')  # One of DATASET_SIZES
+DUCKDB_MEMORY_LIMIT = os.getenv('DUCKDB_MEMORY_LIMIT', '512MB')  # Per open user database
+DUCKDB_THREADS = int(os.getenv('DUCKDB_THREADS', 2))
+DUCKDB_QUOTA_POLL_SECONDS = 0.1  # How often a running statement's file growth is checked
+
+# DuckDB versions of the DATASET_CATALOG generators, built into the shared base file
+DUCKDB_DATASET_TABLES = {
+    'ecommerce': [
+        ('customers', """
+            CREATE TABLE {table} AS
+            SELECT i AS id,
+                   'Customer ' || i AS name,
+                   'customer' || i || '@example.com' AS email,
+                   ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix', 'Seattle', 'Denver', 'Boston'][1 + floor(random() * 8)::INT] AS city,
+                   DATE '2020-01-01' + floor(random() * 1460)::INT AS signup_date
+            FROM range(1, {dim_rows} + 1) t(i)
+        """),
+        ('products', """
+            CREATE TABLE {table} AS
+            SELECT i AS id,
+                   'Product ' || i AS name,
+                   ['Books', 'Electronics', 'Garden', 'Grocery', 'Sports', 'Toys'][1 + floor(random() * 6)::INT] AS category,
+                   round(1 + random() * 499, 2)::DECIMAL(10, 2) AS price
+            FROM range(1, {small_rows} + 1) t(i)
+        """),
+        ('orders', """
+            CREATE TABLE {table} AS
+            SELECT i AS id,
+                   1 + floor(random() * {dim_rows})::INT AS customer_id,
+                   1 + floor(random() * {small_rows})::INT AS product_id,
+                   1 + floor(random() * 5)::INT AS quantity,
+                   ['pending', 'shipped', 'delivered', 'returned'][1 + floor(random() * 4)::INT] AS status,
+                   TIMESTAMP '2022-01-01' + to_seconds(floor(random() * 63072000)::BIGINT) AS ordered_at
+            FROM range(1, {rows} + 1) t(i)
+        """),
+    ],
+    'hr': [
+        ('departments', """
+            CREATE TABLE {table} AS
+            SELECT row_number() OVER () AS id, name
+            FROM unnest(['Engineering', 'Sales', 'Marketing', 'Finance', 'Support', 'Legal',
+                         'Operations', 'Research', 'Design', 'People']) t(name)
+        """),
+        ('employees', """
+            CREATE TABLE {table} AS
+            SELECT i AS id,
+                   'Employee ' || i AS name,
+                   1 + floor(random() * 10)::INT AS department_id,
+                   CASE WHEN i > 10 THEN 1 + floor(random() * least(i - 1, {dim_rows}))::INT END AS manager_id,
+                   ['Associate', 'Analyst', 'Engineer', 'Manager', 'Director'][1 + floor(random() * 5)::INT] AS title,
+                   round(40000 + random() * 160000, 2)::DECIMAL(12, 2) AS salary,
+                   DATE '2010-01-01' + floor(random() * 5000)::INT AS hire_date
+            FROM range(1, {rows} + 1) t(i)
+        """),
+    ],
+    'events': [
+        ('events', """
+            CREATE TABLE {table} AS
+            SELECT i AS id,
+                   1 + floor(random() * {dim_rows})::INT AS user_id,
+                   ['page_view', 'click', 'signup', 'purchase', 'logout'][1 + floor(random() * 5)::INT] AS event_type,
+                   ['web', 'ios', 'android'][1 + floor(random() * 3)::INT] AS device,
+                   floor(random() * 60000)::INT AS duration_ms,
+                   TIMESTAMP '2024-01-01' + to_seconds(floor(random() * 31536000)::BIGINT) AS occurred_at
+            FROM range(1, {rows} + 1) t(i)
+        """),
+    ],
+}
+
+DUCKDB_SAMPLE_USERS = """
+    CREATE TABLE main.sample_users AS
+    SELECT * FROM (VALUES
+        (1, 'Alice Smith', 'alice@example.com', 28, 'New York', DATE '2023-01-15'),
+        (2, 'Bob Johnson', 'bob@example.com', 35, 'Los Angeles', DATE '2023-02-20'),
+        (3, 'Charlie Brown', 'charlie@example.com', 42, 'Chicago', DATE '2023-03-10'),
+        (4, 'Diana Davis', 'diana@example.com', 31, 'Houston', DATE '2023-04-05'),
+        (5, 'Eva Wilson', 'eva@example.com', 39, 'Phoenix', DATE '2023-05-22')
+    ) AS t(id, name, email, age, city, registration_date)
+"""
+
+class DuckDBSandbox:
+    """Embedded DuckDB execution backend for practice queries.
+
+    Every user gets a database file of their own, with sample_users and the
+    catalog datasets visible through a shared base file attached read-only.
+    Connections are opened per request, so worker processes take turns on a
+    user's file instead of holding it, and file system access is switched off
+    before any user SQL runs.
+    """
+
+    def __init__(self, directory, dataset_size):
+        self.directory = directory
+        self.dataset_size = dataset_size
+        self.base_path = os.path.join(directory, f"base_{dataset_size}.duckdb")
+        self._base_lock = threading.Lock()
+
+    def ensure_base(self):
+        if os.path.exists(self.base_path):
+            return
+        with self._base_lock:
+            if os.path.exists(self.base_path):
+                return
+            import duckdb
+
+            os.makedirs(self.directory, exist_ok=True)
+            rows = DATASET_SIZES[self.dataset_size]
+            params = {
+                'rows': rows,
+                'dim_rows': max(rows // 10, 100),
+                'small_rows': max(rows // 1000, 20)
+            }
+            start_time = time.time()
+            # Build under a private name and rename, so other processes never see a partial file
+            build_path = f"{self.base_path}.{os.getpid()}.tmp"
+            conn = duckdb.connect(build_path)
+            try:
+                conn.execute("SELECT setseed(0.42)")
+                conn.execute(DUCKDB_SAMPLE_USERS)
+                for dataset, tables in DUCKDB_DATASET_TABLES.items():
+                    conn.execute(f"CREATE SCHEMA {dataset}")
+                    for table_name, statement in tables:
+                        conn.execute(statement.format(table=f"{dataset}.{table_name}", **params))
+                conn.execute("CHECKPOINT")
+            finally:
+                conn.close()
+            os.replace(build_path, self.base_path)
+            app.logger.info(f"Built DuckDB base {self.base_path} in {time.time() - start_time:.1f}s")
+
+    def user_path(self, username):
+        return os.path.join(self.directory, f"user_{username}.duckdb")
+
+    def usage_bytes(self, username):
+        path = self.user_path(username)
+        return sum(os.path.getsize(file_path) for file_path in (path, f"{path}.wal") if os.path.exists(file_path))
+
+    def reclaim_space(self, conn):
+        # A checkpoint truncates free blocks off the end of the file, but is skipped
+        # when nothing changed, so give it a throwaway change to write
+        name = f"reclaim_{secrets.token_hex(8)}"
+        conn.execute(f"CREATE SEQUENCE {name}")
+        conn.execute(f"DROP SEQUENCE {name}")
+        conn.execute("CHECKPOINT")
+
+    @contextmanager
+    def quota_guard(self, conn, username):
+        """Interrupt the running statement once the user's files outgrow USER_SCHEMA_QUOTA_BYTES.
+
+        DuckDB writes large uncommitted results straight into the database file,
+        so checking only between statements would let one statement fill the disk.
+        """
+        exceeded = threading.Event()
+        done = threading.Event()
+
+        def watch():
+            while not done.wait(DUCKDB_QUOTA_POLL_SECONDS):
+                if self.usage_bytes(username) > USER_SCHEMA_QUOTA_BYTES:
+                    exceeded.set()
+                    conn.interrupt()
+                    return
+
+        watcher = threading.Thread(target=watch, name=f"duckdb-quota-{username}", daemon=True)
+        watcher.start()
+        try:
+            yield exceeded
+        finally:
+            done.set()
+            watcher.join()
+
+    @contextmanager
+    def connect(self, username):
+        import duckdb
+
+        self.ensure_base()
+        path = self.user_path(username)
+        config = {'memory_limit': DUCKDB_MEMORY_LIMIT, 'threads': DUCKDB_THREADS}
+        for attempt in range(20):
+            try:
+                conn = duckdb.connect(path, config=config)
+                break
+            except duckdb.IOException:
+                # Another worker process has the file open; it only holds it for one request
+                if attempt == 19:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+        try:
+            conn.execute(f"ATTACH '{self.base_path}' AS shared (READ_ONLY)")
+            search_path = ",".join(["main", "shared.main"] + [f"shared.{dataset}" for dataset in DUCKDB_DATASET_TABLES])
+            conn.execute(f"SET search_path = '{search_path}'")
+            # Spilled intermediates count against the quota too
+            conn.execute(f"SET temp_directory = '{path}.tmp'")
+            conn.execute(f"SET max_temp_directory_size = '{USER_SCHEMA_QUOTA_BYTES}B'")
+            conn.execute("SET enable_external_access = false")
+            conn.execute("SET lock_configuration = true")
+            yield conn
+        finally:
+            conn.close()
+
+    def execute(self, username, statements):
+        results = []
+        with self.connect(username) as conn:
+            conn.execute("BEGIN TRANSACTION")
+            try:
+                for stmt in statements:
+                    stmt_type = sqlparse.parse(stmt)[0].get_type()
+                    if stmt_type == 'CREATE' and re.search(r'\bTABLE\b', stmt, re.IGNORECASE):
+                        table_count = conn.execute(
+                            "SELECT COUNT(*) FROM duckdb_tables() WHERE database_name = current_database()"
+                        ).fetchone()[0]
+                        if table_count >= MAX_TABLES_PER_USER:
+                            raise ValueError("Table limit reached")
+                    # Statements that free space stay allowed at the quota
+                    if stmt_type not in ('SELECT', 'DROP', 'DELETE') and self.usage_bytes(username) >= USER_SCHEMA_QUOTA_BYTES:
+                        raise QuotaExceededError(f"Your DuckDB database has reached its {USER_SCHEMA_QUOTA_BYTES} byte quota")
+
+                    with self.quota_guard(conn, username) as exceeded:
+                        try:
+                            cursor = conn.execute(stmt)
+                        except Exception:
+                            if exceeded.is_set():
+                                raise QuotaExceededError(f"Statement stopped at the {USER_SCHEMA_QUOTA_BYTES} byte quota")
+                            raise
+                    if self.usage_bytes(username) > USER_SCHEMA_QUOTA_BYTES:
+                        raise QuotaExceededError(f"Statement would exceed the {USER_SCHEMA_QUOTA_BYTES} byte quota")
+                    if stmt_type in ('INSERT', 'UPDATE', 'DELETE'):
+                        results.append({
+                            "type": "message",
+                            "content": f"{cursor.fetchone()[0]} rows affected"
+                        })
+                    elif cursor.description and stmt_type not in ('CREATE', 'DROP', 'ALTER'):
+                        columns = [desc[0] for desc in cursor.description]
+                        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                        results.append({
+                            "type": "table",
+                            "columns": columns,
+                            "rows": json.loads(json.dumps(rows, cls=CustomJSONEncoder))
+                        })
+                    else:
+                        results.append({
+                            "type": "message",
+                            "content": "Statement executed"
+                        })
+                conn.execute("COMMIT")
+                if any(sqlparse.parse(stmt)[0].get_type() in ('DROP', 'DELETE') for stmt in statements):
+                    self.reclaim_space(conn)
+            except QuotaExceededError:
+                conn.execute("ROLLBACK")
+                # Rolled-back blocks stay in the file until a checkpoint truncates it
+                self.reclaim_space(conn)
+                raise
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return results
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
@@ -77,204 +2069,196 @@ class User(UserMixin):
         self.password_hash = password_hash
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 @login_manager.user_loader
 def load_user(user_id):
-    logger.debug(f"Loading user: {user_id}")
+    user = user_cache.get(str(user_id))
+    if user is not None:
+        return user
+    logger.debug("Loading user: %s", user_id)
     user = wrapper.get_user(user_id)
-    logger.debug(f"Loaded user: {user}")
+    logger.debug("Loaded user: %s", user)
+    if user is not None:
+        user_cache.set(str(user_id), user)
     return user
 
 class LLMSQLWrapper:
     def __init__(self, db_config):
         self.superuser_config = db_config
-        self.user_connections = {}
-        self.user_passwords = {}  # Add this line to store user passwords
+        self.user_pool = UserConnectionPool(self.open_user_connection, MAX_USER_CONNECTIONS)
+        # Role passwords are derived from this secret, so any worker on any host can
+        # connect as a user without the plain password ever being kept in memory
+        self.role_password_secret = os.getenv('ROLE_PASSWORD_SECRET') or os.getenv('SECRET_KEY')
+        if not self.role_password_secret:
+            raise ValueError("ROLE_PASSWORD_SECRET or SECRET_KEY must be set in environment variables")
         self.groq_api_key = os.getenv('GROQ_API_KEY')
         if not self.groq_api_key:
             raise ValueError("GROQ_API_KEY not found in environment variables")
         self.model = 'llama-3.1-70b-versatile'
-        self.groq_chat = ChatGroq(groq_api_key=self.groq_api_key, model_name=self.model)
-        self.memory = ConversationBufferWindowMemory(k=5, memory_key="chat_history", return_messages=True)
-
-        # Apply retry logic to the sequence and table creation
-        self.create_sequences_and_tables()
+        self._groq_chat = None
+        self.chat_history_window = 5
+        self.result_cache = ResultCache(RESULT_CACHE_BYTES)
+        self.replica_router = ReplicaRouter(db_config, DB_REPLICAS)
+        self.duckdb_sandbox = DuckDBSandbox(DUCKDB_DIR, DUCKDB_DATASET_SIZE)
+        # DDL from any worker also drops this process's cached plans for the user
+        self.schema_feed = SchemaChangeFeed(db_config, self.describe_table, on_change=self.result_cache.forget_user)
+        self.provisioning_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="provisioning")
+        self.provisioning_pending = set()
+        self.provisioning_lock = threading.Lock()
+        self.dataset_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dataset-build")
+        self.dataset_builds_pending = set()
+
+        migration_start = time.perf_counter()
+        self.migrations_applied = self.run_migrations()
+        self.migration_seconds = time.perf_counter() - migration_start
+
+    @property
+    def groq_chat(self):
+        # LangChain and the Groq client are slow to import, so load them on first use
+        if self._groq_chat is None:
+            from langchain_groq import ChatGroq
+            self._groq_chat = ChatGroq(groq_api_key=self.groq_api_key, model_name=self.model)
+        return self._groq_chat
 
     def get_superuser_connection(self):
-        return psycopg2.connect(**self.superuser_config)
+        return pooled_connection()
 
-    def get_user_connection(self, username):
-        if username not in self.user_connections:
-            user_config = self.superuser_config.copy()
-            user_config['user'] = username
-            user_config['password'] = self.user_passwords.get(username)
+    def derive_role_password(self, username):
+        return hmac.new(self.role_password_secret.encode(), f"role:{username}".encode(), hashlib.sha256).hexdigest()
 
-            if not user_config['password']:
-                raise psycopg2.OperationalError(f"No password found for user {username}. Please log in again.")
+    def open_user_connection(self, username, replica=None):
+        user_config = (replica['config'] if replica else self.superuser_config).copy()
+        user_config['user'] = username
+        user_config['password'] = self.derive_role_password(username)
 
-            try:
-                self.user_connections[username] = psycopg2.connect(**user_config)
-            except psycopg2.OperationalError as e:
-                app.logger.error(f"Failed to connect for user {username}: {str(e)}")
-                raise
-        return self.user_connections[username]
+        try:
+            return psycopg2.connect(**user_config)
+        except psycopg2.OperationalError as e:
+            app.logger.error(f"Failed to connect for user {username}: {str(e)}")
+            raise
 
-    def create_sequences_and_tables(self):
+    def get_user_connection(self, username, replica=None):
+        return self.user_pool.connection(username, replica)
+
+    def run_migrations(self):
+        """Apply pending MIGRATIONS; a single version check when the schema is current."""
+        latest_version = MIGRATIONS[-1][0]
         try:
-            app.logger.info("Creating sequences and tables...")
             with self.get_superuser_connection() as conn:
                 with conn.cursor() as cur:
+                    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+                    if cur.fetchone()[0]:
+                        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                        if cur.fetchone()[0] >= latest_version:
+                            return 0
+
+                    # Only one process migrates; the others wait here and then find nothing to do
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
                     cur.execute("""
-                        CREATE TABLE IF NOT EXISTS users (
-                            id SERIAL PRIMARY KEY,
-                            username VARCHAR(50) UNIQUE NOT NULL,
-                            password_hash VARCHAR(255) NOT NULL,
-                            email VARCHAR(100) UNIQUE NOT NULL,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
-
-                        CREATE TABLE IF NOT EXISTS query_history (
-                            id BIGSERIAL PRIMARY KEY,
-                            user_id INTEGER NOT NULL,
-                            query_definition TEXT NOT NULL,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            results JSONB
-                        );
-
-                        CREATE TABLE IF NOT EXISTS question_history (
-                            id BIGSERIAL PRIMARY KEY,
-                            user_id INTEGER NOT NULL,
-                            category VARCHAR,
-                            question TEXT,
-                            tables TEXT,
-                            hint TEXT,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
-
-                        CREATE TABLE IF NOT EXISTS submission_history (
-                            id BIGSERIAL PRIMARY KEY,
-                            user_id INTEGER NOT NULL,
-                            question_id BIGINT,
-                            correctness_score INT,
-                            efficiency_score INT,
-                            style_score INT,
-                            overall_feedback TEXT,
-                            pass_fail BOOLEAN,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        );
-
-                        -- Enable Row Level Security
-                        ALTER TABLE query_history ENABLE ROW LEVEL SECURITY;
-                        ALTER TABLE question_history ENABLE ROW LEVEL SECURITY;
-                        ALTER TABLE submission_history ENABLE ROW LEVEL SECURITY;
-
-                        -- Create policies if they don't exist
-                        DO $$
-                        BEGIN
-                            IF NOT EXISTS (
-                                SELECT 1 FROM pg_policies 
-                                WHERE tablename = 'query_history' AND policyname = 'query_history_isolation_policy'
-                            ) THEN
-                                CREATE POLICY query_history_isolation_policy ON query_history
-                                    USING (user_id = current_setting('app.current_user_id')::INTEGER);
-                            END IF;
-
-                            IF NOT EXISTS (
-                                SELECT 1 FROM pg_policies 
-                                WHERE tablename = 'question_history' AND policyname = 'question_history_isolation_policy'
-                            ) THEN
-                                CREATE POLICY question_history_isolation_policy ON question_history
-                                    USING (user_id = current_setting('app.current_user_id')::INTEGER);
-                            END IF;
-
-                            IF NOT EXISTS (
-                                SELECT 1 FROM pg_policies 
-                                WHERE tablename = 'submission_history' AND policyname = 'submission_history_isolation_policy'
-                            ) THEN
-                                CREATE POLICY submission_history_isolation_policy ON submission_history
-                                    USING (user_id = current_setting('app.current_user_id')::INTEGER);
-                            END IF;
-                        END
-                        $$;
-
-                        -- Function to set current user
-                        CREATE OR REPLACE FUNCTION set_current_user(p_user_id INTEGER)
-                        RETURNS VOID AS $$
-                        BEGIN
-                            PERFORM set_config('app.current_user_id', p_user_id::TEXT, FALSE);
-                        END;
-                        $$ LANGUAGE plpgsql;
-
-                        -- Sample public dataset
-                        CREATE TABLE IF NOT EXISTS public.sample_dataset (
-                            id SERIAL PRIMARY KEY,
-                            name VARCHAR(100),
-                            value INTEGER
-                        );
-
-                        GRANT SELECT ON public.sample_dataset TO PUBLIC;
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            name TEXT NOT NULL,
+                            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
                     """)
-                    conn.commit()
-            app.logger.info("Tables and sequences created or already exist.")
+                    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+                    current_version = cur.fetchone()[0]
+
+                    applied = 0
+                    for version, name, statement in MIGRATIONS:
+                        if version <= current_version:
+                            continue
+                        app.logger.info(f"Applying migration {version}: {name}")
+                        cur.execute(statement)
+                        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                        applied += 1
+                conn.commit()
+            app.logger.info(f"Applied {applied} migrations, schema is at version {latest_version}")
+            return applied
         except Exception as e:
-            app.logger.error(f"Error creating sequences and tables: {str(e)}")
+            app.logger.error(f"Error running migrations: {str(e)}")
             raise
 
     def get_schema(self, username):
-        schema = []
+        replica = self.replica_router.choose(self.read_position())
+        if replica is not None:
+            try:
+                with self.get_user_connection(username, replica) as conn:
+                    with conn.cursor() as cur:
+                        return self.collect_schema(cur, username)
+            except psycopg2.OperationalError as e:
+                app.logger.warning(f"Reading schema from primary, replica {replica['address']} failed: {str(e)}")
+                self.replica_router.mark_down(replica)
+
         with self.get_user_connection(username) as conn:
             with conn.cursor() as cur:
-                # Get the user's schema and public schema
-                cur.execute(f"""
-                    SELECT schema_name 
-                    FROM information_schema.schemata 
-                    WHERE schema_name = 'public' OR schema_name = 'user_{username}'
-                """)
-                schemas = cur.fetchall()
-
-                for schema_name in schemas:
-                    schema_name = schema_name[0]
-
-                    # Get tables for each schema
-                    cur.execute("""
-                        SELECT table_name 
-                        FROM information_schema.tables 
-                        WHERE table_schema = %s
-                    """, (schema_name,))
-                    tables = cur.fetchall()
-
-                    schema_item = {
-                        "id": f"schema-{schema_name}",
-                        "label": schema_name,
-                        "children": []
-                    }
-
-                    for table in tables:
-                        table_name = table[0]
-                        cur.execute("""
-                            SELECT column_name, data_type 
-                            FROM information_schema.columns 
-                            WHERE table_schema = %s AND table_name = %s
-                        """, (schema_name, table_name))
-                        columns = cur.fetchall()
-
-                        table_item = {
-                            "id": f"table-{schema_name}-{table_name}",
-                            "label": table_name,
-                            "children": [
-                                {
-                                    "id": f"column-{schema_name}-{table_name}-{column[0]}",
-                                    "label": f"{column[0]} ({column[1]})"
-                                } for column in columns
-                            ]
-                        }
-                        schema_item["children"].append(table_item)
-
-                    schema.append(schema_item)
+                return self.collect_schema(cur, username)
+
+    def collect_schema(self, cur, username):
+        schema = []
+        # Get the user's schema and public schema
+        cur.execute(f"""
+            SELECT schema_name 
+            FROM information_schema.schemata 
+            WHERE schema_name = 'public' OR schema_name = 'user_{username}'
+        """)
+        schemas = cur.fetchall()
+
+        for schema_name in schemas:
+            schema_name = schema_name[0]
+
+            # Get tables for each schema
+            cur.execute("""
+                SELECT table_name 
+                FROM information_schema.tables 
+                WHERE table_schema = %s
+            """, (schema_name,))
+            tables = cur.fetchall()
+
+            schema_item = {
+                "id": f"schema-{schema_name}",
+                "label": schema_name,
+                "children": []
+            }
+
+            for table in tables:
+                table_name = table[0]
+                cur.execute("""
+                    SELECT column_name, data_type 
+                    FROM information_schema.columns 
+                    WHERE table_schema = %s AND table_name = %s
+                """, (schema_name, table_name))
+                columns = cur.fetchall()
+                schema_item["children"].append(self.schema_table_item(schema_name, table_name, columns))
+
+            schema.append(schema_item)
 
         return schema
 
+    def schema_table_item(self, schema_name, table_name, columns):
+        return {
+            "id": f"table-{schema_name}-{table_name}",
+            "label": table_name,
+            "children": [
+                {
+                    "id": f"column-{schema_name}-{table_name}-{column[0]}",
+                    "label": f"{column[0]} ({column[1]})"
+                } for column in columns
+            ]
+        }
+
+    def describe_table(self, schema_name, table_name):
+        columns = self.execute_with_retry("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            ORDER BY ordinal_position
+        """, (schema_name, table_name))
+        return self.schema_table_item(
+            schema_name, table_name, [(column['column_name'], column['data_type']) for column in columns]
+        )
+
     @retry(
         stop=stop_after_attempt(5),
         wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -289,46 +2273,74 @@ class LLMSQLWrapper:
                     return cur.fetchall()
                 return None
 
+    def read_position(self):
+        """WAL position a replica must have replayed to serve this client's reads.
+
+        Comes from the READ_AFTER_COOKIE set after the client's last write, so
+        routing a read costs no round trip to the primary.
+        """
+        if not self.replica_router.replicas or not has_request_context():
+            return None
+        if g.get('user_wrote'):
+            # Written earlier in this request; the cookie is only set as it ends
+            return float('inf')
+        try:
+            return lsn_to_int(request.cookies[READ_AFTER_COOKIE])
+        except (KeyError, ValueError):
+            return None
+
+    def write_position(self):
+        # Every commit made for this request precedes the current WAL position
+        return self.execute_with_retry("SELECT pg_current_wal_lsn()::TEXT AS lsn")[0]['lsn']
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+        retry=retry_if_exception_type((psycopg2.OperationalError, psycopg2.InterfaceError))
+    )
+    def execute_read(self, query, params=None):
+        """Like execute_with_retry, but for read-only lookups a replica may serve."""
+        with self.replica_router.connection(self.read_position()) as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, params)
+                return cur.fetchall()
+
 
-    def execute_query(self, query, user_id, username):
+    def execute_query(self, query, user_id, username, mode='standard', engine='postgres'):
         try:
-            statements = sqlparse.split(query)
+            statements = [statement.strip() for statement in sqlparse.split(query) if statement.strip()]
+            if engine == 'duckdb':
+                results = self.duckdb_sandbox.execute(username, statements)
+                self.add_to_query_history(query, results, user_id)
+                return results
+
+            stmt_types = [sqlparse.parse(stmt)[0].get_type() for stmt in statements]
             results = []
 
+            cache_key = None
+            if self.result_cache.enabled and mode == 'standard' and stmt_types == ['SELECT']:
+                cache_key = normalize_sql(statements[0])
+                cached = self.get_cached_result(username, cache_key)
+                if cached is not None:
+                    self.add_to_query_history(query, cached, user_id)
+                    return cached
+            elif self.result_cache.enabled and any(stmt_type != 'SELECT' for stmt_type in stmt_types):
+                self.result_cache.forget_user(username)
+
             with self.get_user_connection(username) as conn:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     cur.execute(f"SET search_path TO user_{username}, public")
 
-                    for statement in statements:
-                        stmt = statement.strip()
-                        if not stmt:
-                            continue
-
-                        stmt_type = sqlparse.parse(stmt)[0].get_type()
-
-                        if stmt_type == 'CREATE':
-                            result = self.handle_create_statement(cur, stmt, username)
-                            results.append({
-                                "type": "message",
-                                "content": result["message"]
-                            })
-                        else:
-                            cur.execute(stmt)
-                            if cur.description:
-                                columns = [desc[0] for desc in cur.description]
-                                rows = cur.fetchall()
-                                # Use the custom JSON encoder here
-                                json_compatible_rows = json.loads(json.dumps(rows, cls=CustomJSONEncoder))
-                                results.append({
-                                    "type": "table",
-                                    "columns": columns,
-                                    "rows": json_compatible_rows
-                                })
-                            else:
-                                results.append({
-                                    "type": "message",
-                                    "content": f"{cur.rowcount} rows affected"
-                                })
+                    if mode == 'script':
+                        results = self.execute_script(cur, statements, username)
+                    else:
+                        cache_entry = None
+                        if cache_key is not None:
+                            cache_entry = self.plan_cached_result(cur, username, cache_key, statements[0])
+                        for stmt, stmt_type in zip(statements, stmt_types):
+                            results.append(self.run_statement(cur, stmt, stmt_type, username))
+                        if cache_entry is not None:
+                            self.result_cache.put(cache_entry[0], results, cache_entry[1])
 
                     conn.commit()
 
@@ -344,6 +2356,306 @@ class LLMSQLWrapper:
             app.logger.error(f"Error executing query: {str(e)}")
             raise
 
+    def fetch_shared_table_versions(self):
+        return {
+            row['relation']: row['version']
+            for row in self.execute_with_retry("SELECT relation, version FROM shared_table_versions")
+        }
+
+    def get_cached_result(self, username, cache_key):
+        plan = self.result_cache.get_plan(username, cache_key)
+        if plan is None or plan[0] is None:
+            return None
+        versions = self.result_cache.table_versions(self.fetch_shared_table_versions)
+        return self.result_cache.get(plan[0], versions)
+
+    def plan_cached_result(self, cur, username, cache_key, stmt):
+        """Decide whether a SELECT may be cached; returns (plan_key, versions) or None."""
+        plan = self.result_cache.get_plan(username, cache_key)
+        if plan is None:
+            plan = self.explain_for_result_cache(cur, stmt)
+            self.result_cache.set_plan(username, cache_key, *plan)
+        plan_key, relations = plan
+        if plan_key is None:
+            return None
+
+        versions = self.result_cache.table_versions(self.fetch_shared_table_versions)
+        if not all(relation in versions for relation in relations):
+            return None
+        return plan_key, {relation: versions[relation] for relation in relations}
+
+    def explain_for_result_cache(self, cur, stmt):
+        cur.execute(f"EXPLAIN (VERBOSE, COSTS OFF, FORMAT JSON) {stmt.rstrip(';')}")
+        plan = list(cur.fetchone().values())[0]
+        plan_text = json.dumps(plan, sort_keys=True)
+
+        relations = set()
+        modifies = False
+        nodes = [node['Plan'] for node in plan]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Node Type') in ('ModifyTable', 'LockRows'):
+                modifies = True
+            if 'Relation Name' in node:
+                relations.add(f"{node.get('Schema')}.{node['Relation Name']}")
+            nodes.extend(node.get('Plans', []))
+
+        # Only relations with a version counter are shared and change-tracked
+        versions = self.result_cache.table_versions(self.fetch_shared_table_versions)
+        cacheable = (
+            relations
+            and not modifies
+            and all(relation in versions for relation in relations)
+            and not VOLATILE_FUNCTION_PATTERN.search(plan_text)
+        )
+        if not cacheable or self.plan_uses_user_objects(cur, plan):
+            return None, None
+        return hashlib.sha256(plan_text.encode()).hexdigest(), frozenset(relations)
+
+    def plan_uses_user_objects(self, cur, plan):
+        """True if a plan expression may call a function, operator or type outside pg_catalog.
+
+        Their results aren't tracked by shared_table_versions and, being printed
+        unqualified, two users' same-named objects would share a cache key.
+        """
+        expressions = []
+        values = [plan]
+        while values:
+            value = values.pop()
+            if isinstance(value, dict):
+                values.extend(value.values())
+            elif isinstance(value, list):
+                values.extend(value)
+            elif isinstance(value, str):
+                expressions.append(value)
+        text = "\n".join(expressions)
+
+        def names(pattern):
+            return list({quoted.replace('""', '"') if quoted else bare.lower() for quoted, bare in pattern.findall(text)})
+
+        cur.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_proc p JOIN pg_namespace n ON n.oid = p.pronamespace
+                WHERE n.nspname <> 'pg_catalog' AND p.proname = ANY(%s)
+            ) OR EXISTS (
+                SELECT 1 FROM pg_operator o JOIN pg_namespace n ON n.oid = o.oprnamespace
+                WHERE n.nspname <> 'pg_catalog' AND o.oprname = ANY(%s)
+            ) OR EXISTS (
+                SELECT 1 FROM pg_type t JOIN pg_namespace n ON n.oid = t.typnamespace
+                WHERE n.nspname NOT IN ('pg_catalog', 'information_schema') AND t.typtype <> 'c'
+                  AND t.typname = ANY(%s)
+            ) AS uses_user_objects
+        """, (names(PLAN_FUNCTION_PATTERN), list(set(PLAN_OPERATOR_PATTERN.findall(text))), names(PLAN_TYPE_PATTERN)))
+        return cur.fetchone()['uses_user_objects']
+
+    def run_statement(self, cur, stmt, stmt_type, username):
+        if stmt_type == 'CREATE':
+            result = self.handle_create_statement(cur, stmt, username)
+            return {
+                "type": "message",
+                "content": result["message"]
+            }
+
+        cur.execute(stmt)
+        if cur.description:
+            columns = [desc[0] for desc in cur.description]
+            rows = cur.fetchall()
+            # Use the custom JSON encoder here
+            json_compatible_rows = json.loads(json.dumps(rows, cls=CustomJSONEncoder))
+            return {
+                "type": "table",
+                "columns": columns,
+                "rows": json_compatible_rows
+            }
+        return {
+            "type": "message",
+            "content": f"{cur.rowcount} rows affected"
+        }
+
+    def execute_script(self, cur, statements, username):
+        """Run a pasted script, isolating every statement behind a savepoint.
+
+        Consecutive statements that don't return rows are sent to the server in
+        batches of SCRIPT_BATCH_SIZE, one round trip each. If a batch fails it is
+        rolled back to its savepoint and replayed one statement at a time, so the
+        failing statement is reported and the rest of the script still runs.
+
+        The server reports neither the row count nor the timing of each statement
+        in a successful batch: their results carry the batch's size and
+        batch_elapsed_ms instead, and only the last one its row count.
+        """
+        results = []
+        batch = []
+
+        for index, stmt in enumerate(statements):
+            stmt_type = sqlparse.parse(stmt)[0].get_type()
+
+            if is_transaction_control(stmt):
+                self.execute_script_batch(cur, batch, results, username)
+                batch = []
+                results.append({
+                    "type": "error",
+                    "statement": index,
+                    "content": "Transaction control statements are not supported in script mode",
+                    "elapsed_ms": 0.0
+                })
+            elif stmt_type in ('SELECT', 'CREATE', 'UNKNOWN') or re.search(r'\bRETURNING\b', stmt, re.IGNORECASE):
+                # Anything that returns rows or needs rewriting runs on its own
+                self.execute_script_batch(cur, batch, results, username)
+                batch = []
+                results.append(self.execute_with_savepoint(cur, index, stmt, stmt_type, username))
+            else:
+                batch.append((index, stmt, stmt_type))
+                if len(batch) >= SCRIPT_BATCH_SIZE:
+                    self.execute_script_batch(cur, batch, results, username)
+                    batch = []
+
+        self.execute_script_batch(cur, batch, results, username)
+        return results
+
+    def execute_script_batch(self, cur, batch, results, username):
+        if not batch:
+            return
+        if len(batch) == 1:
+            index, stmt, stmt_type = batch[0]
+            results.append(self.execute_with_savepoint(cur, index, stmt, stmt_type, username))
+            return
+
+        start_time = time.perf_counter()
+        cur.execute("SAVEPOINT script_batch")
+        try:
+            cur.execute("\n".join(stmt if stmt.endswith(';') else f"{stmt};" for _, stmt, _ in batch))
+            # The server only reports the row count of the last statement in a batch
+            last_rowcount = cur.rowcount
+            cur.execute("RELEASE SAVEPOINT script_batch")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT script_batch")
+            app.logger.info(f"Script batch of {len(batch)} statements failed, replaying individually: {str(e)}")
+            for index, stmt, stmt_type in batch:
+                results.append(self.execute_with_savepoint(cur, index, stmt, stmt_type, username))
+            return
+
+        elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+        for position, (index, _, _) in enumerate(batch):
+            last = position == len(batch) - 1
+            results.append({
+                "type": "message",
+                "statement": index,
+                "content": f"{last_rowcount} rows affected" if last and last_rowcount >= 0
+                           else f"Statement executed (batch of {len(batch)})",
+                "batch_size": len(batch),
+                "batch_elapsed_ms": elapsed_ms
+            })
+
+    def execute_with_savepoint(self, cur, index, stmt, stmt_type, username):
+        start_time = time.perf_counter()
+        cur.execute("SAVEPOINT script_statement")
+        try:
+            result = self.run_statement(cur, stmt, stmt_type, username)
+            cur.execute("RELEASE SAVEPOINT script_statement")
+        except (psycopg2.Error, ValueError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT script_statement")
+            result = {
+                "type": "error",
+                "content": str(e).strip()
+            }
+        result["statement"] = index
+        result["elapsed_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+        return result
+
+    def export_query(self, query, username, file_format):
+        """Yield the result of a read-only query as CSV or Parquet chunks.
+
+        The query runs on a dedicated connection in a producer thread; the
+        generator hands back chunks as they arrive and cancels the query if it
+        is closed early.
+        """
+        statement = export_statement(query)
+
+        # Counts against MAX_USER_CONNECTIONS, but is closed rather than reused afterwards
+        conn = self.user_pool.checkout(username)
+        writer = QueueWriter()
+
+        def produce():
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    cur.execute(f"SET LOCAL search_path TO user_{username}, public")
+                if file_format == 'csv':
+                    self.write_csv(conn, statement, writer)
+                else:
+                    self.write_parquet(conn, statement, writer)
+                conn.rollback()
+                writer.finish()
+            except Exception as e:
+                writer.finish(e)
+
+        producer = threading.Thread(target=produce, name=f"export-{username}", daemon=True)
+        producer.start()
+        try:
+            yield from writer
+        finally:
+            writer.cancel()
+            if producer.is_alive():
+                conn.cancel()
+            producer.join()
+            conn.close()
+            self.user_pool.release(conn, username)
+
+    def write_csv(self, conn, statement, writer):
+        # A named cursor, like Parquet, so the user's text is never spliced into a COPY command
+        with conn.cursor(name="export_cursor") as cur:
+            cur.itersize = EXPORT_CSV_BATCH_ROWS
+            cur.execute(statement)
+            rows = cur.fetchmany(EXPORT_CSV_BATCH_ROWS)
+            buffer = io.StringIO()
+            csv_writer = csv.writer(buffer)
+            csv_writer.writerow([desc[0] for desc in cur.description])
+            while rows:
+                csv_writer.writerows(
+                    ['' if value is None else export_text(value) for value in row] for row in rows
+                )
+                writer.write(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+                rows = cur.fetchmany(EXPORT_CSV_BATCH_ROWS)
+            if buffer.tell():
+                writer.write(buffer.getvalue().encode('utf-8'))
+
+    def write_parquet(self, conn, statement, writer):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # A named cursor keeps the result on the server and fetches it batch by batch
+        with conn.cursor(name="export_cursor") as cur:
+            cur.itersize = EXPORT_PARQUET_BATCH_ROWS
+            cur.execute(statement)
+            rows = cur.fetchmany(EXPORT_PARQUET_BATCH_ROWS)
+            column_names = [desc[0] for desc in cur.description]
+            arrow_types = [postgres_type_to_arrow(desc[1], desc[4], desc[5]) for desc in cur.description]
+            schema = pa.schema([(name, arrow_type) for name, (arrow_type, _) in zip(column_names, arrow_types)])
+
+            def to_table(rows):
+                arrays = []
+                for index, (arrow_type, convert) in enumerate(arrow_types):
+                    values = [row[index] for row in rows]
+                    if convert:
+                        values = [None if value is None else convert(value) for value in values]
+                    try:
+                        arrays.append(pa.array(values, type=arrow_type))
+                    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                        raise ValueError(f"Column {column_names[index]} cannot be exported as {arrow_type}: {e}")
+                return pa.Table.from_arrays(arrays, schema=schema)
+
+            # Convert the first batch before the writer sends its header, so a conversion
+            # error becomes an error response rather than a truncated file
+            table = to_table(rows)
+            with pq.ParquetWriter(writer, schema) as parquet_writer:
+                while table.num_rows:
+                    # Each fetched batch becomes one row group
+                    parquet_writer.write_table(table)
+                    rows = cur.fetchmany(EXPORT_PARQUET_BATCH_ROWS)
+                    table = to_table(rows)
 
     def handle_create_statement(self, cur, sql, username):
         match = re.search(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', sql, re.IGNORECASE)
@@ -365,6 +2677,125 @@ class LLMSQLWrapper:
         cur.execute(modified_sql)
         return {"message": f"Table {table_name} created successfully"}
 
+    def get_user_schema_size(self, username):
+        return self.execute_with_retry("""
+            SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0) AS size
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind IN ('r', 'm')
+        """, (f'user_{username}',))[0]['size']
+
+    def get_import_allowance(self, username):
+        remaining = USER_SCHEMA_QUOTA_BYTES - self.get_user_schema_size(username)
+        return max(0, min(MAX_IMPORT_BYTES, remaining))
+
+    def prepare_import_table(self, cur, username, table_name, columns, column_types):
+        schema_name = f"user_{username}"
+        cur.execute("""
+            SELECT 1 FROM information_schema.tables WHERE table_schema = %s AND table_name = %s
+        """, (schema_name, table_name))
+        if cur.fetchone():
+            return False
+
+        if self.get_user_table_count(username) >= MAX_TABLES_PER_USER:
+            raise ValueError("Table limit reached")
+        self.result_cache.forget_user(username)
+        cur.execute(sql.SQL("CREATE TABLE {}.{} ({})").format(
+            sql.Identifier(schema_name),
+            sql.Identifier(table_name),
+            sql.SQL(", ").join(
+                sql.SQL("{} {}").format(sql.Identifier(column), sql.SQL(column_type))
+                for column, column_type in zip(columns, column_types)
+            )
+        ))
+        return True
+
+    def copy_statement(self, username, table_name, columns, header):
+        return sql.SQL("COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv, HEADER {})").format(
+            sql.Identifier(f"user_{username}"),
+            sql.Identifier(table_name),
+            sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+            sql.SQL("true" if header else "false")
+        )
+
+    def import_csv(self, username, table_name, stream, limit):
+        mark_user_write()
+        sample = stream.read(IMPORT_SAMPLE_BYTES)
+        sample_text = sample.decode('utf-8', errors='replace')
+        if len(sample) == IMPORT_SAMPLE_BYTES:
+            # Drop the trailing partial line so it doesn't skew inference
+            sample_text = sample_text[:sample_text.rfind('\n') + 1] or sample_text
+        sample_rows = list(csv.reader(io.StringIO(sample_text)))
+        if not sample_rows:
+            raise ValueError("The uploaded CSV file is empty")
+
+        header, data_rows = sample_rows[0], sample_rows[1:]
+        columns = []
+        for index, name in enumerate(header):
+            column = sanitize_identifier(name, f"column_{index + 1}")
+            while column in columns:
+                column = f"{column}_{index + 1}"
+            columns.append(column)
+        column_types = [
+            infer_csv_column_type([row[index] for row in data_rows if index < len(row)])
+            for index in range(len(columns))
+        ]
+
+        with self.get_user_connection(username) as conn:
+            with conn.cursor() as cur:
+                created = self.prepare_import_table(cur, username, table_name, columns, column_types)
+                reader = QuotaReader(sample, stream, limit)
+                try:
+                    cur.copy_expert(self.copy_statement(username, table_name, columns, header=True).as_string(conn),
+                                    reader)
+                except psycopg2.Error:
+                    if reader.exceeded:
+                        raise QuotaExceededError(f"Upload exceeds the {limit} byte import quota")
+                    raise
+                row_count = cur.rowcount
+            conn.commit()
+        return {"table": f"user_{username}.{table_name}", "created": created, "rows": row_count}
+
+    def import_parquet(self, username, table_name, stream, limit):
+        mark_user_write()
+        try:
+            import pyarrow as pa
+            import pyarrow.csv as pa_csv
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet import requires the pyarrow package")
+
+        stream.seek(0, os.SEEK_END)
+        if stream.tell() > limit:
+            raise QuotaExceededError(f"Upload exceeds the {limit} byte import quota")
+        stream.seek(0)
+
+        parquet_file = pq.ParquetFile(stream)
+        arrow_schema = parquet_file.schema_arrow
+        columns = []
+        for index, name in enumerate(arrow_schema.names):
+            column = sanitize_identifier(name, f"column_{index + 1}")
+            while column in columns:
+                column = f"{column}_{index + 1}"
+            columns.append(column)
+        column_types = [arrow_type_to_postgres(field.type) for field in arrow_schema]
+
+        row_count = 0
+        with self.get_user_connection(username) as conn:
+            with conn.cursor() as cur:
+                created = self.prepare_import_table(cur, username, table_name, columns, column_types)
+                copy_sql = self.copy_statement(username, table_name, columns, header=False).as_string(conn)
+                # One row group batch at a time keeps memory flat regardless of file size
+                for batch in parquet_file.iter_batches(batch_size=65536):
+                    buffer = io.BytesIO()
+                    pa_csv.write_csv(pa.Table.from_batches([batch]), buffer,
+                                     pa_csv.WriteOptions(include_header=False))
+                    buffer.seek(0)
+                    cur.copy_expert(copy_sql, buffer)
+                    row_count += batch.num_rows
+            conn.commit()
+        return {"table": f"user_{username}.{table_name}", "created": created, "rows": row_count}
+
     def get_user_table_count(self, username):
         return self.execute_with_retry("""
             SELECT COUNT(*) 
@@ -373,6 +2804,7 @@ class LLMSQLWrapper:
         """, (f'user_{username}',))[0]['count']
 
     def add_to_query_history(self, query, results, user_id):
+        mark_user_write()
         limited_results = results[:100] if results else []
         self.execute_with_retry("""
             INSERT INTO query_history (user_id, query_definition, timestamp, results)
@@ -380,7 +2812,7 @@ class LLMSQLWrapper:
         """, (user_id, query, datetime.now(), json.dumps(limited_results, cls=DateTimeEncoder)))
 
     def get_query_history(self, user_id, limit=5):
-        return self.execute_with_retry(f"""
+        return self.execute_read(f"""
             SELECT query_definition, timestamp, results
             FROM query_history
             WHERE user_id = %s
@@ -392,7 +2824,7 @@ class LLMSQLWrapper:
         if is_practice:
             return self.generate_practice_question(category, user_id, username)
 
-        app.logger.info(f"Received question: {question}")
+        app.logger.info("Received question: %s", LogPayload(question))
 
         query_history = self.get_query_history(user_id, limit=3)
         history_str = ""
@@ -403,6 +2835,10 @@ class LLMSQLWrapper:
             history_str += f"Results summary: {len(results_dict)} total results. Top 10 results:\n"
             history_str += json.dumps(top_results, indent=2) + "\n\n"
 
+        from langchain.chains import LLMChain
+        from langchain_core.messages import SystemMessage
+        from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, MessagesPlaceholder
+
         schema_str = str(self.get_schema(username))
         system_prompt = f"""You are an AI assistant that provides information about SQL queries and their results based on the query history.
         Database schema: {schema_str}
@@ -421,21 +2857,75 @@ class LLMSQLWrapper:
         conversation = LLMChain(
             llm=self.groq_chat,
             prompt=prompt,
-            verbose=True,
-            memory=self.memory,
+            verbose=LLM_VERBOSE,
+            memory=self.load_chat_memory(user_id),
         )
 
         try:
-            app.logger.debug(f"Sending request to Groq API with prompt: {prompt}")
+            app.logger.debug("Sending request to Groq API with prompt: %s", LogPayload(prompt))
             generated_response = conversation.predict(human_input=question)
-            app.logger.info(f"Generated response: {generated_response}")
+            app.logger.info("Generated response: %s", LogPayload(generated_response))
+            self.save_chat_exchange(user_id, question, generated_response)
             return generated_response
         except Exception as e:
             app.logger.error(f"Error generating response: {str(e)}")
             app.logger.error(f"Full exception: {traceback.format_exc()}")
             return f"I apologize, but I encountered an error while processing your question. Error details: {str(e)}"
 
+    def load_chat_memory(self, user_id):
+        from langchain.chains.conversation.memory import ConversationBufferWindowMemory
+
+        memory = ConversationBufferWindowMemory(k=self.chat_history_window, memory_key="chat_history", return_messages=True)
+        messages = self.execute_with_retry("""
+            SELECT role, content FROM (
+                SELECT id, role, content
+                FROM chat_messages
+                WHERE user_id = %s
+                ORDER BY id DESC
+                LIMIT %s
+            ) recent
+            ORDER BY id
+        """, (user_id, self.chat_history_window * 2))
+        for message in messages:
+            if message['role'] == 'human':
+                memory.chat_memory.add_user_message(message['content'])
+            else:
+                memory.chat_memory.add_ai_message(message['content'])
+        return memory
+
+    def save_chat_exchange(self, user_id, question, response):
+        self.execute_with_retry("""
+            INSERT INTO chat_messages (user_id, role, content)
+            VALUES (%s, 'human', %s), (%s, 'ai', %s)
+        """, (user_id, question, user_id, response))
+
+    def predict_structured(self, conversation, fields, kind, lenient_extract=None, **inputs):
+        """Run a chain that must answer in JSON, re-asking once with the validation errors."""
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        response = conversation.predict(**inputs)
+        try:
+            return parse_structured_output(response, fields, kind, lenient_extract)
+        except LLMOutputError as e:
+            app.logger.warning(f"Invalid {kind} reply, asking for a correction: {str(e)}")
+            llm_parse_stats[kind]['reasked'] += 1
+            messages = conversation.prompt.format_messages(**inputs) + [
+                AIMessage(content=response),
+                HumanMessage(content=f"Your reply could not be used: {str(e)}. "
+                                     "Reply again with only the corrected JSON object and no other text.")
+            ]
+            corrected = self.groq_chat.invoke(messages).content
+            try:
+                return parse_structured_output(corrected, fields, kind, lenient_extract)
+            except LLMOutputError:
+                llm_parse_stats[kind]['failed'] += 1
+                raise
+
     def generate_practice_question(self, category, user_id, username):
+        from langchain.chains import LLMChain
+        from langchain_core.messages import SystemMessage
+        from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+
         schema_str = str(self.get_schema(username))
         system_prompt = f"""You are an AI assistant that generates SQL practice questions.
             Database schema: {schema_str}
@@ -444,21 +2934,16 @@ class LLMSQLWrapper:
             The question should be challenging but solvable using the provided schema.
             Try to use a variety of tables in your questions.
 
-            Your response must strictly follow this format:
-
-            Question: [Your question here]
-
-            Category: {category}
-
-            Tables: [Comma-separated list of relevant tables in the format user_schema.table_name]
+            Respond with only a JSON object in exactly this shape:
 
-            Hint: [Provide a hint here]
+            {{
+                "question": "The full question text with SQL keywords in ALL CAPS",
+                "category": "{category}",
+                "tables": "Comma-separated list of relevant tables in the format user_schema.table_name",
+                "hint": "A brief, helpful hint for solving the question"
+            }}
 
-            Ensure that:
-            1. The "Question" section contains the full question text with SQL keywords in ALL CAPS.
-            2. The "Tables" section lists only the table names, separated by commas.
-            3. The "Hint" section provides a brief, helpful hint for solving the question.
-            4. Do not include any additional text or explanations outside of these sections.
+            Do not include any text, explanations or code fences outside of the JSON object.
             """
         prompt = ChatPromptTemplate.from_messages([
             SystemMessage(content=system_prompt),
@@ -467,22 +2952,20 @@ class LLMSQLWrapper:
         conversation = LLMChain(
             llm=self.groq_chat,
             prompt=prompt,
-            verbose=True,
+            verbose=LLM_VERBOSE,
         )
         try:
-            generated_response = conversation.predict(category=category)
-            # Parse the generated response using more specific regex patterns
-            category_match = re.search(r'Category:\s*(.+?)\s*\n', generated_response)
-            question_match = re.search(r'Question:\s*(.+?)\s*\n', generated_response, re.DOTALL)
-            tables_match = re.search(r'Tables:\s*(.+?)\s*\n', generated_response)
-            hint_match = re.search(r'Hint:\s*(.+?)\s*$', generated_response, re.DOTALL)
-
-            category = category_match.group(1).strip() if category_match else category
-            question = question_match.group(1).strip() if question_match else ""
-            tables = tables_match.group(1).strip() if tables_match else ""
-            hint = hint_match.group(1).strip() if hint_match else ""
+            generated = self.predict_structured(
+                conversation, PRACTICE_QUESTION_FIELDS, 'practice_question',
+                lenient_extract=extract_practice_question_text, category=category
+            )
+            category = generated['category'] or category
+            question = generated['question']
+            tables = generated['tables']
+            hint = generated['hint']
 
             # Stfore the parsed question in the question_history table
+            mark_user_write()
             result = self.execute_with_retry("""
             INSERT INTO question_history (user_id, category, question, tables, hint)
             VALUES (%s, %s, %s, %s, %s)
@@ -504,13 +2987,17 @@ class LLMSQLWrapper:
             return None
 
     def get_practice_question(self, question_id, user_id):
-        return self.execute_with_retry("""
+        return self.execute_read("""
             SELECT id, category, question, tables, hint, timestamp
             FROM question_history
             WHERE id = %s AND user_id = %s
         """, (question_id, user_id))
 
     def validate_solution(self, sql_query, results, question_id, user_id, username):
+        from langchain.chains import LLMChain
+        from langchain_core.messages import SystemMessage
+        from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
+
         schema_str = str(self.get_schema(username))
 
         # Handle default question
@@ -532,7 +3019,7 @@ class LLMSQLWrapper:
 
         app.logger.info(f"Validating solution for question ID: {question_id}")
         app.logger.info(f"Question category: {category}")
-        app.logger.info(f"Question text: {question_text[:100]}...") # Log first 100 chars of question
+        app.logger.info("Question text: %s", LogPayload(question_text))
 
         system_prompt = f"""You are an AI assistant that validates SQL solutions for practice questions.
         Database schema: {schema_str}
@@ -547,19 +3034,20 @@ class LLMSQLWrapper:
         2. Efficiency (Score /10): Is the query optimized? Suggest improvements if needed.
         3. Style (Score /10): Does the query follow good SQL practices? Offer specific style suggestions.
 
-        Format your response as follows:
-        Correctness (X/10): [Brief explanation]
-        Efficiency (X/10): [Brief explanation]
-        Style (X/10): [Brief explanation]
-
-        Overall feedback: [2-3 sentences summarizing the main points and offering encouragement]
+        Respond with only a JSON object in exactly this shape, where every score is an integer from 0 to 10:
 
-        Improvement suggestions:
-        - [Bullet point 1]
-        - [Bullet point 2]
-        - [Bullet point 3 (if needed)]
+        {{
+            "correctness_score": 0,
+            "correctness": "Brief explanation",
+            "efficiency_score": 0,
+            "efficiency": "Brief explanation",
+            "style_score": 0,
+            "style": "Brief explanation",
+            "overall_feedback": "2-3 sentences summarizing the main points and offering encouragement",
+            "improvement_suggestions": ["Suggestion 1", "Suggestion 2", "Suggestion 3 (if needed)"]
+        }}
 
-        Keep your total response under 250 words.
+        Keep the total text under 250 words and do not include anything outside of the JSON object.
         """
 
         prompt = ChatPromptTemplate.from_messages([
@@ -570,23 +3058,35 @@ class LLMSQLWrapper:
         conversation = LLMChain(
             llm=self.groq_chat,
             prompt=prompt,
-            verbose=True,
+            verbose=LLM_VERBOSE,
         )
 
         try:
-            feedback = conversation.predict()
-
-            # Parse the feedback to extract scores and overall feedback
-            correctness_score = int(re.search(r'Correctness \((\d+)/10\)', feedback).group(1))
-            efficiency_score = int(re.search(r'Efficiency \((\d+)/10\)', feedback).group(1))
-            style_score = int(re.search(r'Style \((\d+)/10\)', feedback).group(1))
-            overall_feedback = re.search(r'Overall feedback: (.+?)(?=\n\n|$)', feedback, re.DOTALL).group(1).strip()
+            evaluation = self.predict_structured(
+                conversation, SOLUTION_FEEDBACK_FIELDS, 'solution_feedback',
+                lenient_extract=extract_solution_feedback_text
+            )
+            correctness_score = evaluation['correctness_score']
+            efficiency_score = evaluation['efficiency_score']
+            style_score = evaluation['style_score']
+            overall_feedback = evaluation['overall_feedback']
+
+            # Keep the text layout the frontend parses scores from
+            feedback = (
+                f"Correctness ({correctness_score}/10): {evaluation['correctness']}\n"
+                f"Efficiency ({efficiency_score}/10): {evaluation['efficiency']}\n"
+                f"Style ({style_score}/10): {evaluation['style']}\n\n"
+                f"Overall feedback: {overall_feedback}\n\n"
+                "Improvement suggestions:\n"
+                + "\n".join(f"- {suggestion}" for suggestion in evaluation['improvement_suggestions'])
+            )
 
             # Calculate pass/fail
             average_score = (correctness_score + efficiency_score + style_score) / 3
             pass_fail = average_score >= 7 and min(correctness_score, efficiency_score, style_score) >= 5
 
             # Insert the submission record
+            mark_user_write()
             self.execute_with_retry("""
                 INSERT INTO submission_history 
                 (user_id, question_id, correctness_score, efficiency_score, style_score, overall_feedback, pass_fail)
@@ -637,89 +3137,203 @@ class LLMSQLWrapper:
         """
 
         try:
-            result = self.execute_with_retry(query, (user_id,))
-            app.logger.info(f"Raw query result: {result}")
+            result = self.execute_read(query, (user_id,))
+            app.logger.debug("Raw query result: %s", LogPayload(result))
             return result
         except Exception as e:
             app.logger.error(f"An error occurred while fetching submission history: {str(e)}")
             raise
 
-    def create_user_table(self, user_id, username):
+    def provision_user(self, cur, user_id, username):
+        """Apply the provisioning template to a user's schema inside the caller's transaction."""
         schema_name = f"user_{username}"
-        table_name = f"sample_users"
-
-        create_table_query = f"""
-        CREATE TABLE IF NOT EXISTS {schema_name}.{table_name} (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(100),
-            email VARCHAR(100),
-            age INTEGER,
-            city VARCHAR(100),
-            registration_date DATE
-        )
-        """
-        enable_rls_query = f"ALTER TABLE {schema_name}.{table_name} ENABLE ROW LEVEL SECURITY;"
-
-        create_rls_policy_query = f"""
-        CREATE POLICY user_{username}_own_data_policy ON {schema_name}.{table_name}
-        FOR ALL
-        USING (current_user = '{username}');
-        """
-
-        check_data_query = f"SELECT COUNT(*) FROM {schema_name}.{table_name}"
-        insert_data_query = f"""
-        INSERT INTO {schema_name}.{table_name} (name, email, age, city, registration_date)
-        SELECT * FROM (VALUES
-            ('Alice Smith', 'alice@example.com', 28, 'New York', '2023-01-15'::DATE),
-            ('Bob Johnson', 'bob@example.com', 35, 'Los Angeles', '2023-02-20'::DATE),
-            ('Charlie Brown', 'charlie@example.com', 42, 'Chicago', '2023-03-10'::DATE),
-            ('Diana Davis', 'diana@example.com', 31, 'Houston', '2023-04-05'::DATE),
-            ('Eva Wilson', 'eva@example.com', 39, 'Phoenix', '2023-05-22'::DATE)
-        ) AS new_data(name, email, age, city, registration_date)
-        WHERE NOT EXISTS (
-            SELECT 1 FROM {schema_name}.{table_name} LIMIT 1
-        )
-        """
+        for statement in USER_PROVISIONING_TEMPLATE:
+            cur.execute(statement.format(schema=schema_name, username=username))
+        cur.execute("""
+            UPDATE users SET provisioned_version = %s WHERE id = %s
+        """, (PROVISIONING_VERSION, user_id))
+        app.logger.info(f"Provisioned schema {schema_name} at version {PROVISIONING_VERSION}")
+
+    def upgrade_user_provisioning(self, user_id, username):
         try:
             with self.get_superuser_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(create_table_query)
-                    app.logger.info(f"Table {schema_name}.{table_name} created or already exists.")
-                    cur.execute(enable_rls_query)
-                    app.logger.info(f"RLS enabled on table {schema_name}.{table_name}.")
-                    cur.execute(create_rls_policy_query)
-                    app.logger.info(f"RLS policy created for table {schema_name}.{table_name}.")
-                    cur.execute(check_data_query)
-                    row_count = cur.fetchone()[0]
-                    if row_count == 0:
-                        cur.execute(insert_data_query)
-                        app.logger.info(f"Sample data inserted into {schema_name}.{table_name}.")
-                    else:
-                        app.logger.info(f"Table {schema_name}.{table_name} already contains data. Skipping insertion.")
+                    # Another worker may be upgrading the same user; let it finish
+                    cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('user_provisioning'), %s)", (user_id,))
+                    if not cur.fetchone()[0]:
+                        return
+                    cur.execute("SELECT provisioned_version FROM users WHERE id = %s FOR UPDATE", (user_id,))
+                    row = cur.fetchone()
+                    if row is None or row[0] >= PROVISIONING_VERSION:
+                        return
+                    self.provision_user(cur, user_id, username)
                 conn.commit()
-            app.logger.info(f"Successfully created and populated table {table_name} for user {username}")
         except Exception as e:
-            app.logger.error(f"Error creating user table: {str(e)}")
+            app.logger.error(f"Error provisioning user {username}: {str(e)}")
             raise
+        finally:
+            with self.provisioning_lock:
+                self.provisioning_pending.discard(user_id)
+
+    def schedule_provisioning_upgrade(self, user_id, username):
+        with self.provisioning_lock:
+            if user_id in self.provisioning_pending:
+                return
+            self.provisioning_pending.add(user_id)
+        self.provisioning_executor.submit(self.upgrade_user_provisioning, user_id, username)
+
+    def schedule_stale_provisioning_upgrades(self, batch_size=500):
+        # Only previously provisioned users; never-provisioned users are handled at login
+        stale_users = self.execute_with_retry("""
+            SELECT id, username
+            FROM users
+            WHERE provisioned_version BETWEEN 1 AND %s
+            ORDER BY id
+            LIMIT %s
+        """, (PROVISIONING_VERSION - 1, batch_size))
+        for user in stale_users:
+            self.schedule_provisioning_upgrade(user['id'], user['username'])
+        app.logger.info(f"Scheduled provisioning upgrades for {len(stale_users)} users")
+
+    def list_datasets(self):
+        built = {
+            (row['dataset'], row['size_label']): row
+            for row in self.execute_with_retry("SELECT dataset, size_label, schema_name, built_at FROM dataset_catalog")
+        }
+        return [
+            {
+                "dataset": dataset,
+                "description": definition['description'],
+                "tables": [table_name for table_name, _ in definition['tables']],
+                "engines": {
+                    "postgres": [size_label for size_label in DATASET_SIZES],
+                    "duckdb": [DUCKDB_DATASET_SIZE] if dataset in DUCKDB_DATASET_TABLES else []
+                },
+                "sizes": [
+                    {
+                        "size": size_label,
+                        "rows": rows,
+                        "built": (dataset, size_label) in built,
+                        "clonable": rows <= MAX_CLONE_ROWS
+                    } for size_label, rows in DATASET_SIZES.items()
+                ]
+            } for dataset, definition in DATASET_CATALOG.items()
+        ]
+
+    def get_dataset_schema(self, dataset, size_label):
+        result = self.execute_with_retry("""
+            SELECT schema_name FROM dataset_catalog WHERE dataset = %s AND size_label = %s
+        """, (dataset, size_label))
+        return result[0]['schema_name'] if result else None
+
+    def build_dataset(self, dataset, size_label):
+        definition = DATASET_CATALOG[dataset]
+        rows = DATASET_SIZES[size_label]
+        schema_name = f"dataset_{dataset}_{size_label}"
+        params = {
+            'rows': rows,
+            'dim_rows': max(rows // 10, 100),
+            'small_rows': max(rows // 1000, 20)
+        }
+        start_time = time.time()
+        try:
+            with self.get_superuser_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (schema_name,))
+                    cur.execute("""
+                        SELECT 1 FROM dataset_catalog WHERE dataset = %s AND size_label = %s
+                    """, (dataset, size_label))
+                    if cur.fetchone():
+                        return schema_name
+
+                    cur.execute("SET LOCAL maintenance_work_mem = '256MB'")
+                    cur.execute(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE")
+                    cur.execute(f"CREATE SCHEMA {schema_name}")
+                    cur.execute("SELECT setseed(0.42)")  # Same data for every build of a dataset
+                    for table_name, statement in definition['tables']:
+                        table = f"{schema_name}.{table_name}"
+                        # Bulk-load first, then index, which is much faster than loading an indexed table
+                        cur.execute(statement.format(table=table, **params))
+                        cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id)")
+                        cur.execute(f"ANALYZE {table}")
+                    cur.execute(f"GRANT USAGE ON SCHEMA {schema_name} TO PUBLIC")
+                    cur.execute(f"GRANT SELECT ON ALL TABLES IN SCHEMA {schema_name} TO PUBLIC")
+                    # Templates are read-only; a rebuild bumps their versions so cached results expire
+                    for table_name, _ in definition['tables']:
+                        cur.execute("""
+                            INSERT INTO shared_table_versions (relation) VALUES (%s)
+                            ON CONFLICT (relation) DO UPDATE SET version = shared_table_versions.version + 1
+                        """, (f"{schema_name}.{table_name}",))
+                    cur.execute("""
+                        INSERT INTO dataset_catalog (dataset, size_label, schema_name, row_count)
+                        VALUES (%s, %s, %s, %s)
+                    """, (dataset, size_label, schema_name, rows))
+                conn.commit()
+            app.logger.info(f"Built dataset {schema_name} in {time.time() - start_time:.1f}s")
+            return schema_name
+        except Exception as e:
+            app.logger.error(f"Error building dataset {schema_name}: {str(e)}")
+            raise
+        finally:
+            with self.provisioning_lock:
+                self.dataset_builds_pending.discard((dataset, size_label))
+
+    def schedule_dataset_build(self, dataset, size_label):
+        key = (dataset, size_label)
+        with self.provisioning_lock:
+            if key in self.dataset_builds_pending:
+                return
+            self.dataset_builds_pending.add(key)
+        self.dataset_executor.submit(self.build_dataset, dataset, size_label)
+
+    def attach_dataset(self, username, dataset, size_label, mode, source_schema):
+        mark_user_write()
+        definition = DATASET_CATALOG[dataset]
+        schema_name = f"user_{username}"
+        table_names = [table_name for table_name, _ in definition['tables']]
+
+        if mode == 'clone' and DATASET_SIZES[size_label] > MAX_CLONE_ROWS:
+            raise ValueError(f"Datasets larger than {MAX_CLONE_ROWS} rows can only be attached as shared views")
+        if self.get_user_table_count(username) + len(table_names) > MAX_TABLES_PER_USER:
+            raise ValueError("Table limit reached")
+
+        with self.get_superuser_connection() as conn:
+            with conn.cursor() as cur:
+                for table_name in table_names:
+                    source = f"{source_schema}.{table_name}"
+                    target = f"{schema_name}.{table_name}"
+                    if mode == 'shared':
+                        # A view costs nothing to create and always reads the shared template
+                        cur.execute(f"CREATE VIEW {target} AS SELECT * FROM {source}")
+                    else:
+                        # Server-side copy: no rows travel through the app
+                        cur.execute(f"CREATE TABLE {target} AS TABLE {source}")
+                        cur.execute(f"ALTER TABLE {target} ADD PRIMARY KEY (id)")
+                        cur.execute(f"ALTER TABLE {target} OWNER TO {username}")
+                    cur.execute(f"GRANT SELECT ON {target} TO {username}")
+            conn.commit()
+        self.result_cache.forget_user(username)
+        app.logger.info(f"Attached dataset {source_schema} to {schema_name} as {mode}")
+        return [f"{schema_name}.{table_name}" for table_name in table_names]
 
     def create_user(self, username, password, email):
         if not re.match(r'^[a-z][a-z0-9_]{2,62}$', username):
             raise ValueError("Username must start with a letter, contain only lowercase letters, numbers, and underscores, and be 3-63 characters long.")
 
-        password_hash = generate_password_hash(password)
+        password_hash = password_hasher.hash(password)
         try:
             with self.get_superuser_connection() as conn:
                 with conn.cursor() as cur:
                     # Create the PostgreSQL user if it doesn't exist
                     cur.execute("SELECT 1 FROM pg_roles WHERE rolname = %s", (username,))
                     if not cur.fetchone():
-                        cur.execute(f"CREATE ROLE {username} LOGIN PASSWORD %s", (password,))
+                        cur.execute(f"CREATE ROLE {username} LOGIN PASSWORD %s", (self.derive_role_password(username),))
                         app.logger.info(f"Created PostgreSQL role: {username}")
 
                     # Insert the user record
                     cur.execute("""
-                        INSERT INTO users (username, password_hash, email)
-                        VALUES (%s, %s, %s)
+                        INSERT INTO users (username, password_hash, email, role_password_derived)
+                        VALUES (%s, %s, %s, TRUE)
                         RETURNING id
                     """, (username, password_hash, email))
                     user_id = cur.fetchone()[0]
@@ -731,11 +3345,12 @@ class LLMSQLWrapper:
                     cur.execute(f"GRANT ALL ON SCHEMA user_{username} TO {username}")
                     cur.execute(f"ALTER DEFAULT PRIVILEGES IN SCHEMA user_{username} GRANT ALL ON TABLES TO {username}")
 
+                    # Seed the schema in the same transaction so registration is all-or-nothing
+                    self.provision_user(cur, user_id, username)
+
                     conn.commit()
-                self.user_passwords[username] = password
                 return user_id
         except psycopg2.IntegrityError:
-            conn.rollback()
             raise ValueError("Username or email already exists")
 
     def get_user(self, user_id):
@@ -751,7 +3366,7 @@ class LLMSQLWrapper:
 
     def authenticate_user(self, username, password):
         result = self.execute_with_retry("""
-            SELECT id, username, password_hash
+            SELECT id, username, password_hash, provisioned_version, role_password_derived
             FROM users
             WHERE username = %s
         """, (username,))
@@ -760,33 +3375,84 @@ class LLMSQLWrapper:
             user = User(id=user_data['id'], username=user_data['username'], password_hash=user_data['password_hash'])
             if user.check_password(password):
                 app.logger.info(f"User {username} authenticated successfully.")
-                self.user_passwords[username] = password  # Store the plain password for connection purposes
-                try:
-                    self.create_user_table(user.id, username)
-                    app.logger.info(f"User table for user_id {user.id} created or verified.")
-                except Exception as e:
-                    app.logger.error(f"Error creating user table for user_id {user.id}: {str(e)}")
+                if not user_data['role_password_derived']:
+                    self.migrate_role_password(user.id, username)
+                if password_hasher.needs_rehash(user.password_hash):
+                    self.rehash_password(user.id, password)
+                provisioned_version = user_data['provisioned_version']
+                if provisioned_version == 0:
+                    # Never provisioned: the user needs their tables before the first query
+                    try:
+                        self.upgrade_user_provisioning(user.id, username)
+                    except Exception as e:
+                        app.logger.error(f"Error provisioning user_id {user.id}: {str(e)}")
+                elif provisioned_version < PROVISIONING_VERSION:
+                    self.schedule_provisioning_upgrade(user.id, username)
                 return user
         app.logger.warning(f"Authentication failed for user {username}")
         return None
 
-    def clear_stored_passwords(self):
-        self.user_passwords.clear()
-        self.user_connections.clear()
+    def rehash_password(self, user_id, password):
+        # PASSWORD_HASH_METHOD changed since this hash was stored; upgrade it now we have the password
+        try:
+            password_hash = password_hasher.hash(password)
+        except PasswordHasherBusyError:
+            return
+        self.execute_with_retry("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user_id))
+        app.logger.info(f"Rehashed password for user_id {user_id} with {password_hasher.method}")
+
+    def migrate_role_password(self, user_id, username):
+        # Roles created before derived credentials still use the user's own password
+        with self.get_superuser_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"ALTER ROLE {username} PASSWORD %s", (self.derive_role_password(username),))
+                cur.execute("UPDATE users SET role_password_derived = TRUE WHERE id = %s", (user_id,))
+            conn.commit()
+        app.logger.info(f"Migrated role {username} to a derived password")
+
+    def close_user_connections(self):
+        self.user_pool.close_idle()
+
+wrapper_lock = threading.Lock()
+startup_metrics = {}
 
-def initialize_wrapper():
+def initialize_wrapper(trigger='first_request'):
     global wrapper
-    if wrapper is None:
-        db_config = {
-            'dbname': os.getenv('DB_NAME'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD'),
-            'host': os.getenv('DB_HOST'),
-            'port': os.getenv('DB_PORT')
-        }
-        wrapper = LLMSQLWrapper(db_config)
-        wrapper.clear_stored_passwords()
-        app.logger.info("LLMSQLWrapper initialized.")
+    if wrapper is not None:
+        return
+    with wrapper_lock:
+        if wrapper is not None:
+            return
+        init_start = time.perf_counter()
+        wrapper = LLMSQLWrapper(get_db_config())
+        startup_metrics.update({
+            "wrapper_init_seconds": round(time.perf_counter() - init_start, 3),
+            "migration_seconds": round(wrapper.migration_seconds, 3),
+            "migrations_applied": wrapper.migrations_applied,
+            "import_to_ready_seconds": round(time.perf_counter() - process_start_time, 3),
+            "initialized_by": trigger
+        })
+        wrapper.provisioning_executor.submit(wrapper.schedule_stale_provisioning_upgrades)
+        wrapper.schema_feed.start()
+        app.logger.info(f"LLMSQLWrapper initialized. Startup metrics: {startup_metrics}")
+
+@app.before_request
+def ensure_wrapper():
+    # gunicorn initializes workers from post_worker_init; this covers other WSGI servers
+    initialize_wrapper()
+
+@app.after_request
+def record_user_write(response):
+    # Travels with the client, so whichever worker or host serves its next read routes it correctly
+    if g.get('user_wrote') and wrapper.replica_router.replicas:
+        try:
+            response.set_cookie(
+                READ_AFTER_COOKIE, wrapper.write_position(), max_age=READ_AFTER_COOKIE_SECONDS,
+                httponly=True, samesite='Lax', secure=app.config['SESSION_COOKIE_SECURE']
+            )
+        except Exception as e:
+            app.logger.error(f"Error recording write position: {str(e)}")
+    return response
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -800,9 +3466,12 @@ def register():
 
     try:
         user_id = wrapper.create_user(username, password, email)
+        user_cache.pop(str(user_id))
         return jsonify({"message": "User registered successfully", "user_id": user_id}), 201
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except PasswordHasherBusyError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -810,11 +3479,14 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    user = wrapper.authenticate_user(username, password)
+    try:
+        user = wrapper.authenticate_user(username, password)
+    except PasswordHasherBusyError as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
     if user:
-        logger.debug(f"Before login_user, session: {session.items()}")
+        logger.debug("Before login_user, session: %s", LogPayload(dict(session)))
         login_user(user)
-        logger.debug(f"After login_user, session: {session.items()}")
+        logger.debug("After login_user, session: %s", LogPayload(dict(session)))
         return jsonify({"message": "Logged in successfully", "user_id": user.id}), 200
     else:
         return jsonify({"error": "Invalid username or password"}), 401
@@ -822,6 +3494,7 @@ def login():
 @app.route('/logout', methods=['POST'])
 @login_required
 def logout(): 
+    user_cache.pop(str(current_user.id))
     logout_user()
     session.clear()
     return jsonify({"message": "Logged out successfully"}), 200
@@ -846,10 +3519,18 @@ def get_submission_history():
 def execute_sql():
     try:
         sql = request.json.get('sql')
+        mode = request.json.get('mode', 'standard')
+        engine = request.json.get('engine', 'postgres')
         if not sql:
             return jsonify({"error": "SQL query is not provided"}), 400
+        if mode not in ('standard', 'script'):
+            return jsonify({"error": "Mode must be 'standard' or 'script'"}), 400
+        if engine not in ('postgres', 'duckdb'):
+            return jsonify({"error": "Engine must be 'postgres' or 'duckdb'"}), 400
+        if engine == 'duckdb' and mode != 'standard':
+            return jsonify({"error": "Script mode is only available on the postgres engine"}), 400
 
-        results = wrapper.execute_query(sql, current_user.id, current_user.username)
+        results = wrapper.execute_query(sql, current_user.id, current_user.username, mode, engine)
 
         # Wrap the results in a single structure
         response = {
@@ -866,6 +3547,10 @@ def execute_sql():
             "message": str(e),
             "query": sql
         }), 403
+    except ImportError:
+        return jsonify({"error": "The duckdb engine is not installed on this server"}), 501
+    except QuotaExceededError as e:
+        return jsonify({"error": "Quota Exceeded", "message": str(e), "query": sql}), 413
     except Exception as e:
         app.logger.error(f"Unhandled exception: {str(e)}")
         return jsonify({
@@ -879,8 +3564,9 @@ def execute_sql():
 @login_required
 def ask():
     app.logger.info("Received POST request to /ask")
-    app.logger.debug(f"Headers: {request.headers}")
-    app.logger.debug(f"Body: {request.get_json()}")
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Headers: %s", LogPayload(dict(request.headers)))
+        app.logger.debug("Body: %s", LogPayload(request.get_json()))
     data = request.json
     question = data.get('question')
     is_practice = data.get('is_practice', False)
@@ -921,12 +3607,44 @@ def fetch_schema():
         app.logger.error(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+@app.route('/schema/stream', methods=['GET'])
+@login_required
+def stream_schema():
+    if not schema_stream_slots.acquire(blocking=False):
+        # The client falls back to GET /schema and retries the stream later
+        return jsonify({"error": "Too many schema streams on this worker"}), 503, {'Retry-After': '30'}
+    username = current_user.username
+    subscriber = wrapper.schema_feed.subscribe(username)
+
+    def generate():
+        # One full snapshot per connection, then only deltas
+        yield f"retry: 5000\nevent: snapshot\ndata: {json.dumps(wrapper.get_schema(username))}\n\n"
+        deadline = time.monotonic() + SCHEMA_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                delta = subscriber.get(timeout=SCHEMA_FEED_HEARTBEAT)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: schema\ndata: {json.dumps(delta)}\n\n"
+
+    def close_stream():
+        wrapper.schema_feed.unsubscribe(username, subscriber)
+        schema_stream_slots.release()
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(generate(), mimetype='text/event-stream', headers=headers)
+    # Runs when the server closes the response, even if the generator never started
+    response.call_on_close(close_stream)
+    return response
+
 @app.route('/submit-solution', methods=['POST'])
 @login_required
 def submit_solution():
     app.logger.info("Received POST request to /submit-solution")
-    app.logger.debug(f"Headers: {request.headers}")
-    app.logger.debug(f"Body: {request.get_json()}")
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Headers: %s", LogPayload(dict(request.headers)))
+        app.logger.debug("Body: %s", LogPayload(request.get_json()))
 
     data = request.json
     sql_query = data.get('sql')
@@ -947,6 +3665,9 @@ def submit_solution():
 
         app.logger.info("Successfully validated solution and added to query history")
         return jsonify({"feedback": feedback}), 200
+    except LLMOutputError as e:
+        app.logger.error(f"Unusable feedback from the model: {str(e)}")
+        return jsonify({"error": "The grader returned an unusable reply, please try again", "message": str(e)}), 502
     except ValueError as ve:
         app.logger.error(f"ValueError occurred: {str(ve)}")
         return jsonify({"error": str(ve)}), 404
@@ -957,18 +3678,19 @@ def submit_solution():
 
 @app.route('/check-auth', methods=['GET'])
 def check_auth():
-    app.logger.info("check_auth route called")
+    # Polled by the frontend, so only logged at DEBUG
+    app.logger.debug("check_auth route called")
     try:
-        app.logger.info(f"Is authenticated: {current_user.is_authenticated}")
+        app.logger.debug("Is authenticated: %s", current_user.is_authenticated)
         if current_user.is_authenticated:
-            app.logger.info(f"User authenticated: {current_user.username}")
+            app.logger.debug("User authenticated: %s", current_user.username)
             return jsonify({
                 "authenticated": True,
                 "username": current_user.username,
                 "user_id": current_user.id
             }), 200
         else:
-            app.logger.info("User not authenticated")
+            app.logger.debug("User not authenticated")
             return jsonify({"authenticated": False, "message": "User not authenticated"}), 401
     except Exception as e:
         app.logger.error(f"Error in check_auth: {str(e)}")
@@ -979,7 +3701,7 @@ def check_auth():
 def get_current_question():
     try:
         # Fetch the most recent question from question_history
-        result = wrapper.execute_with_retry("""
+        result = wrapper.execute_read("""
             SELECT id, category, question, tables, hint
             FROM question_history
             WHERE user_id = %s
@@ -1004,8 +3726,142 @@ def get_current_question():
         app.logger.error(f"Error fetching current question: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the current question"}), 500
 
+@app.route('/datasets', methods=['GET'])
+@login_required
+def list_datasets():
+    try:
+        return jsonify(wrapper.list_datasets()), 200
+    except Exception as e:
+        app.logger.error(f"Error listing datasets: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/datasets/attach', methods=['POST'])
+@login_required
+def attach_dataset():
+    data = request.json
+    dataset = data.get('dataset')
+    size_label = data.get('size', '10k')
+    mode = data.get('mode', 'shared')
+
+    if dataset not in DATASET_CATALOG or size_label not in DATASET_SIZES:
+        return jsonify({"error": "Unknown dataset or size"}), 400
+    if mode not in ('shared', 'clone'):
+        return jsonify({"error": "Mode must be 'shared' or 'clone'"}), 400
+
+    try:
+        source_schema = wrapper.get_dataset_schema(dataset, size_label)
+        if source_schema is None:
+            # Generating a large template takes a while; let the client retry once it is built
+            wrapper.schedule_dataset_build(dataset, size_label)
+            return jsonify({"status": "building", "dataset": dataset, "size": size_label}), 202
+
+        tables = wrapper.attach_dataset(current_user.username, dataset, size_label, mode, source_schema)
+        return jsonify({"status": "attached", "mode": mode, "tables": tables}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except errors.DuplicateTable as e:
+        return jsonify({"error": f"A table from this dataset already exists in your schema: {str(e)}"}), 409
+    except Exception as e:
+        app.logger.error(f"Error attaching dataset: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": f"Request body exceeds the {MAX_IMPORT_BYTES} byte upload limit"}), 413
+
+@app.route('/import', methods=['POST'])
+@login_required
+def import_file():
+    upload = request.files.get('file')
+    table_name = request.form.get('table', '').strip().lower()
+    if upload is None or not upload.filename:
+        return jsonify({"error": "No file uploaded"}), 400
+    if not re.match(r'^[a-z][a-z0-9_]{2,62}$', table_name):
+        return jsonify({"error": "Invalid table name"}), 400
+
+    file_format = request.form.get('format') or os.path.splitext(upload.filename)[1].lstrip('.').lower()
+    if file_format not in ('csv', 'parquet'):
+        return jsonify({"error": "Only CSV and Parquet files can be imported"}), 400
+
+    try:
+        limit = wrapper.get_import_allowance(current_user.username)
+        if request.content_length and request.content_length > limit + IMPORT_FORM_OVERHEAD_BYTES:
+            raise QuotaExceededError(f"Upload exceeds the {limit} byte import quota")
+
+        if file_format == 'csv':
+            result = wrapper.import_csv(current_user.username, table_name, upload.stream, limit)
+        else:
+            result = wrapper.import_parquet(current_user.username, table_name, upload.stream, limit)
+        app.logger.info(f"Imported {result['rows']} rows into {result['table']}")
+        return jsonify(result), 201
+    except QuotaExceededError as e:
+        return jsonify({"error": str(e)}), 413
+    except errors.InsufficientPrivilege as e:
+        return jsonify({"error": "Insufficient Privilege", "message": str(e)}), 403
+    except (ValueError, psycopg2.DataError, psycopg2.ProgrammingError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error importing file: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/export', methods=['POST'])
+@login_required
+def export_results():
+    data = request.json
+    query = data.get('sql')
+    file_format = data.get('format', 'csv')
+    use_gzip = data.get('gzip', False) and 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    if not query:
+        return jsonify({"error": "SQL query is not provided"}), 400
+    if file_format not in ('csv', 'parquet'):
+        return jsonify({"error": "Format must be 'csv' or 'parquet'"}), 400
+
+    try:
+        chunks = wrapper.export_query(query, current_user.username, file_format)
+        # Pull the first chunk before answering so query errors still get a proper status code
+        first_chunk = next(chunks, b'')
+    except errors.InsufficientPrivilege as e:
+        return jsonify({"error": "Insufficient Privilege", "message": str(e), "query": query}), 403
+    except (ValueError, psycopg2.Error) as e:
+        return jsonify({"error": "Execution Error", "message": str(e), "query": query}), 400
+    except ImportError:
+        return jsonify({"error": "Parquet export requires the pyarrow package"}), 400
+
+    def generate():
+        compressor = zlib.compressobj(wbits=31) if use_gzip else None
+        try:
+            yield compressor.compress(first_chunk) if compressor else first_chunk
+            for chunk in chunks:
+                yield compressor.compress(chunk) if compressor else chunk
+            if compressor:
+                yield compressor.flush()
+        finally:
+            chunks.close()
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="export.{file_format}"'
+    }
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/vnd.apache.parquet'
+    return Response(generate(), mimetype=mimetype, headers=headers)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "user_cache": user_cache.stats(),
+        "startup": startup_metrics,
+        "result_cache": wrapper.result_cache.stats() if wrapper else None,
+        "replicas": wrapper.replica_router.stats() if wrapper else None,
+        "user_connections": wrapper.user_pool.stats() if wrapper else None,
+        "password_hasher": password_hasher.stats(),
+        "logging": {"dropped": log_handler.dropped, "payloads_sampled_out": payload_sampler.sampled_out},
+        "llm_parse": {kind: dict(counts) for kind, counts in llm_parse_stats.items()}
+    }), 200
+
 if __name__ == '__main__':
-    initialize_wrapper()  # Initialize the wrapper before starting the app
+    initialize_wrapper('main')  # Initialize the wrapper before starting the app
     app.run(debug=True, host='127.0.0.1', port=5000)
 
     
\ No newline at end of file
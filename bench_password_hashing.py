@@ -0,0 +1,104 @@
+"""Login throughput benchmark for the password hashing pool.
+
+Simulates a class-start burst on one host: BENCH_CLIENTS request threads each
+verify a password at the same time, spread over `workers` gunicorn workers that
+each own a PasswordHasher, as the app does. The burst runs once inline (the old
+behaviour) and once per per-worker pool size up to the core count, so the default
+(cores // workers) can be compared with oversubscribed pools. While each burst
+runs, another thread times a trivial request-sized task, to show how much the
+burst stalls everything else.
+
+Run with: python bench_password_hashing.py [logins] [workers] [sizes, e.g. 1,2,4]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from app import PasswordHasher, PasswordHasherBusyError
+
+METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+CLIENTS = int(os.getenv('BENCH_CLIENTS', 32))
+
+
+def probe_latency(stop, samples):
+    # Stands in for an unrelated route served by the same worker during the burst
+    while not stop.is_set():
+        start = time.perf_counter()
+        sum(range(1000))
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.005)
+
+
+def run_burst(workers, processes, logins, password_hash):
+    hashers = [PasswordHasher(METHOD, processes, queue_depth=logins) for _ in range(workers)]
+    if processes:
+        # Start the workers before timing, as a long-running server would have them
+        for hasher in hashers:
+            list(hasher.get_executor().map(abs, range(processes)))
+
+    stop = threading.Event()
+    probe_samples = []
+    probe = threading.Thread(target=probe_latency, args=(stop, probe_samples))
+    probe.start()
+
+    latencies = []
+
+    def login(i):
+        start = time.perf_counter()
+        try:
+            assert hashers[i % workers].verify(password_hash, 'correct horse')
+        except PasswordHasherBusyError:
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CLIENTS) as clients:
+        list(clients.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    probe.join()
+    for hasher in hashers:
+        if hasher._executor is not None:
+            hasher._executor.shutdown()
+
+    latencies.sort()
+    return {
+        "logins_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "probe_p95_ms": sorted(probe_samples)[int(len(probe_samples) * 0.95) - 1] * 1000 if probe_samples else 0.0,
+        "rejected": sum(hasher.counts['rejected'] for hasher in hashers)
+    }
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cores = os.cpu_count() or 1
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    password_hash = generate_password_hash('correct horse', METHOD)
+    print(f"method={METHOD} cores={cores} workers={workers} clients={CLIENTS} logins={logins}")
+    print(f"{'processes':>10} {'logins/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'probe p95 ms':>13}")
+
+    default = max(1, cores // workers)
+    if len(sys.argv) > 3:
+        sizes = sorted({int(size) for size in sys.argv[3].split(',')} - {0})
+    else:
+        sizes = sorted({1, default, cores} - {0})
+    for processes in [0] + sizes:
+        result = run_burst(workers, processes, logins, password_hash)
+        label = 'inline' if processes == 0 else f"{processes}{'*' if processes == default else ''}"
+        print(
+            f"{label:>10} {result['logins_per_second']:>10.1f} {result['p50_ms']:>9.1f} "
+            f"{result['p95_ms']:>9.1f} {result['probe_p95_ms']:>13.2f}"
+        )
+    print("processes are per worker; * marks the default, cores // workers")
+
+
+if __name__ == '__main__':
+    main()
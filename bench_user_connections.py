@@ -0,0 +1,53 @@
+"""Hit rate benchmark for the per-user connection pool.
+
+Simulates a class working at once: every request comes from one of `students`
+users (each with their own database role) and lands on a random one of
+`workers` gunicorn workers, each with its own UserConnectionPool. A miss means
+a new connection and a SCRAM handshake; the pool is compared at the old fixed
+size of 4 and at the size the app now derives from the connection budget.
+
+Run with: python bench_user_connections.py [students] [workers]
+"""
+import os
+import random
+import sys
+
+from app import DB_MAX_CONNECTIONS, DB_POOL_MAX, UserConnectionPool
+
+REQUESTS = int(os.getenv('BENCH_REQUESTS', 20000))
+
+
+class FakeConnection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def run(students, workers, max_connections):
+    rng = random.Random(0)
+    pools = [UserConnectionPool(lambda username, replica: FakeConnection(), max_connections) for _ in range(workers)]
+    for _ in range(REQUESTS):
+        username = f"student{rng.randrange(students)}"
+        pool = rng.choice(pools)
+        pool.release(pool.checkout(username), username)
+    reused = sum(pool.counts['reused'] for pool in pools)
+    opened = sum(pool.counts['opened'] for pool in pools)
+    return {"hit_rate": reused / REQUESTS, "opened": opened, "evicted": sum(pool.counts['evicted'] for pool in pools)}
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    budget_size = max(4, (DB_MAX_CONNECTIONS - 3) // workers - DB_POOL_MAX - 1)
+    print(f"students={students} workers={workers} requests={REQUESTS} max_connections={DB_MAX_CONNECTIONS}")
+    print(f"{'pool size':>10} {'hit rate':>9} {'connects':>9} {'evicted':>8}")
+    for size in sorted({4, budget_size}):
+        result = run(students, workers, size)
+        label = f"{size}{'*' if size == budget_size else ''}"
+        print(f"{label:>10} {result['hit_rate']:>9.1%} {result['opened']:>9} {result['evicted']:>8}")
+    print("* marks the default, (DB_MAX_CONNECTIONS - 3) // workers - DB_POOL_MAX - 1")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+# Run with: gunicorn app:app
+# Sessions, chat memory and user credentials are shared through Postgres, so any
+# number of workers (and hosts behind a load balancer) can serve the same users.
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5000')
+# Each worker holds up to DB_POOL_MAX + MAX_USER_CONNECTIONS connections plus one LISTEN
+# connection. Users connect as their own roles and a connection only helps the worker that
+# holds it, so by default start only as many workers as leave each at least 16 user
+# connections (raise GUNICORN_THREADS for concurrency); the app then gives every worker
+# the rest of its share (see app.py and bench_user_connections.py)
+connections_per_worker = int(os.getenv('DB_POOL_MAX', 4)) + int(os.getenv('MAX_USER_CONNECTIONS', 16)) + 1
+connection_budget = int(os.getenv('DB_MAX_CONNECTIONS', 100)) - 3  # superuser_reserved_connections
+workers = int(os.getenv(
+    'WEB_CONCURRENCY',
+    max(1, min(multiprocessing.cpu_count() * 2 + 1, connection_budget // connections_per_worker))
+))
+# Workers inherit this, and size their user connection and password hashing pools to a share of the host
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))  # LLM calls and exports can be slow
+
+
+def post_worker_init(worker):
+    # Run migrations and start background threads before the worker accepts requests,
+    # instead of on its first request
+    from app import initialize_wrapper
+    initialize_wrapper('post_worker_init')
@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { forwardSetCookies } from '@/lib/forwardCookies';
 
 async function executePostgresQuery(sql, cookies) {
   console.log('Executing SQL query:', sql);
@@ -35,7 +36,7 @@ async function executePostgresQuery(sql, cookies) {
     }));
   }
 
-  return responseData;
+  return { data: responseData, backendResponse: response };
 }
 
 export async function POST(request) {
@@ -43,17 +44,10 @@ export async function POST(request) {
     const { sql } = await request.json();
     const cookies = request.headers.get('cookie') || '';
     
-    const data = await executePostgresQuery(sql, cookies);
-    
-    const response = NextResponse.json(data);
-    
-    // Handle Set-Cookie header
-    const setCookieHeader = response.headers.get('Set-Cookie');
-    if (setCookieHeader) {
-      response.headers.set('Set-Cookie', setCookieHeader);
-    }
-    
-    return response;
+    const { data, backendResponse } = await executePostgresQuery(sql, cookies);
+
+    // Forward the backend's Set-Cookie headers (session, read_after_lsn)
+    return forwardSetCookies(backendResponse, NextResponse.json(data));
   } catch (error) {
     console.error('Error in POST handler:', error);
     
@@ -0,0 +1,44 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+// Never cache or pre-render: every request is a long-lived event stream
+export const dynamic = 'force-dynamic';
+
+export async function GET(request: NextRequest) {
+  try {
+    const backendUrl = process.env.BACKEND_URL || 'http://127.0.0.1:5000';
+    const backendResponse = await fetch(`${backendUrl}/schema/stream`, {
+      method: 'GET',
+      headers: {
+        'Cookie': request.headers.get('cookie') || '',
+        'Accept': 'text/event-stream',
+      },
+      cache: 'no-store',
+      // Closing the browser's EventSource aborts the backend stream and frees its worker thread
+      signal: request.signal,
+    });
+
+    if (!backendResponse.ok || !backendResponse.body) {
+      return NextResponse.json(
+        { error: 'Schema stream unavailable' },
+        {
+          status: backendResponse.status,
+          headers: { 'Retry-After': backendResponse.headers.get('Retry-After') || '30' },
+        }
+      );
+    }
+
+    return new Response(backendResponse.body, {
+      headers: {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache, no-transform',
+        'Connection': 'keep-alive',
+      },
+    });
+  } catch (error) {
+    console.error('Error opening schema stream:', error);
+    return NextResponse.json(
+      { error: 'Failed to open schema stream', details: (error as Error).message },
+      { status: 500 }
+    );
+  }
+}
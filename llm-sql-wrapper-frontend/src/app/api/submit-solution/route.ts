@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from 'next/server';
+import { forwardSetCookies } from '@/lib/forwardCookies';
 
 export async function POST(request: NextRequest) {
   console.log('Submit solution API route handler started');
@@ -34,15 +35,8 @@ export async function POST(request: NextRequest) {
     const data = await response.json();
     console.log('Successful response from backend:', data);
 
-    const nextResponse = NextResponse.json(data);
-
     // Forward any Set-Cookie headers from the backend
-    const backendSetCookie = response.headers.get('Set-Cookie');
-    if (backendSetCookie) {
-      nextResponse.headers.set('Set-Cookie', backendSetCookie);
-    }
-
-    return nextResponse;
+    return forwardSetCookies(response, NextResponse.json(data));
   } catch (error) {
     console.error('Detailed error:', error);
     return NextResponse.json({ error: 'An error occurred while processing your request.', details: error.message }, { status: 500 });
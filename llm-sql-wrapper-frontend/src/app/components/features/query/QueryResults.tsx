@@ -2,10 +2,15 @@ import React, { useState } from 'react';
 import { AlertCircle, ChevronLeft, ChevronRight, Table, MessageSquare } from 'lucide-react';
 
 type SingleResult = {
-  type: 'table' | 'message';
+  type: 'table' | 'message' | 'error';
   content?: string;
   columns?: string[];
   rows?: any[];
+  // Script mode: statement index and timing; batched statements only have the batch's total
+  statement?: number;
+  elapsed_ms?: number;
+  batch_size?: number;
+  batch_elapsed_ms?: number;
 };
 
 type MultiResult = {
@@ -109,6 +114,20 @@ const QueryResults: React.FC<QueryResultsProps> = ({
     );
   };
 
+  const renderTiming = (result: SingleResult) => {
+    if (result.elapsed_ms !== undefined) {
+      return <p className="text-sm mt-1">{result.elapsed_ms} ms</p>;
+    }
+    if (result.batch_elapsed_ms !== undefined) {
+      return (
+        <p className="text-sm mt-1">
+          {result.batch_elapsed_ms} ms for a batch of {result.batch_size} statements
+        </p>
+      );
+    }
+    return null;
+  };
+
   const renderMessageResult = (result: SingleResult, index: number) => (
     <div key={index} className="mb-8 bg-blue-100 border-l-4 border-blue-500 text-blue-700 p-4">
       <h4 className="text-xl font-semibold mb-2 flex items-center">
@@ -116,6 +135,7 @@ const QueryResults: React.FC<QueryResultsProps> = ({
         Message
       </h4>
       <p>{result.content}</p>
+      {renderTiming(result)}
     </div>
   );
 
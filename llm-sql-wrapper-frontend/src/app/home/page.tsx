@@ -7,33 +7,22 @@ import ChatTab from '../components/features/chat/ChatTab';
 import PracticeTab from '../components/features/practice/PracticeTab';
 import QueryTab from '../components/features/query/QueryTab';
 import SubmissionsTab from '../components/features/feedback/SubmissionsTab';
-import { SchemaItem, SubmissionHistoryItem } from '../utils/types';
+import { SubmissionHistoryItem } from '../utils/types';
 import { useAuth } from '../hooks/useAuth';
+import { useSchemaStream } from '../hooks/useSchemaStream';
 
 export function Home() {
   const [activeTab, setActiveTab] = useState('practice');
-  const [schemaData, setSchemaData] = useState<SchemaItem[]>([]);
   const [submissionHistory, setSubmissionHistory] = useState<SubmissionHistoryItem[]>([]);
   const [username, setUsername] = useState<string>('');
   const [sharedQuery, setSharedQuery] = useState<string>('');
   const router = useRouter();
   const { isAuthenticated, isLoading } = useAuth();
+  // Full schema once per stream connection, then live updates as tables change
+  const { schemaData } = useSchemaStream(isAuthenticated === true);
 
   console.log('Home component rendered. Auth state:', { isAuthenticated, isLoading });
 
-  const fetchSchema = useCallback(async () => {
-    try {
-      const res = await fetch('/api/schema', { credentials: 'include' });
-      if (!res.ok) {
-        throw new Error('Failed to fetch schema');
-      }
-      const data = await res.json();
-      setSchemaData(data);
-    } catch (err) {
-      console.error('Error fetching schema:', err);
-    }
-  }, []);
-
   const fetchSubmissionHistory = useCallback(async () => {
     try {
       const res = await fetch('/api/submission-history', {
@@ -71,13 +60,12 @@ export function Home() {
     if (isAuthenticated) {
       console.log('User is authenticated, fetching user info');
       fetchUserInfo();
-      fetchSchema();
       fetchSubmissionHistory();
     } else if (isAuthenticated === false) {
       console.log('User is not authenticated, redirecting to login');
       router.push('/login');
     }
-  }, [isAuthenticated, router, fetchSchema, fetchSubmissionHistory]);
+  }, [isAuthenticated, router, fetchSubmissionHistory]);
 
   if (isLoading) {
     return <div>Loading...</div>;
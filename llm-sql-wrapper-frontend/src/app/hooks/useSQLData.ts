@@ -1,26 +1,14 @@
 'use client';
 
 import { useState, useCallback } from 'react';
+import { useSchemaStream } from './useSchemaStream';
 
 export const useSQLData = () => {
-  const [schemaData, setSchemaData] = useState([]);
+  const { schemaData, fetchSchema } = useSchemaStream(true);
   const [submissionHistory, setSubmissionHistory] = useState([]);
   const [isLoadingSubmissions, setIsLoadingSubmissions] = useState(false);
   const [submissionError, setSubmissionError] = useState(null);
 
-  const fetchSchema = useCallback(async () => {
-    try {
-      const res = await fetch('/api/schema');
-      if (!res.ok) {
-        throw new Error('Failed to fetch schema');
-      }
-      const data = await res.json();
-      setSchemaData(data);
-    } catch (err) {
-      console.error('Error fetching schema:', err);
-    }
-  }, []);
-
   const fetchSubmissionHistory = useCallback(async () => {
     setIsLoadingSubmissions(true);
     setSubmissionError(null);
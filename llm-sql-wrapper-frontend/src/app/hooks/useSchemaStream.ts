@@ -0,0 +1,122 @@
+'use client';
+
+import { useState, useEffect, useCallback } from 'react';
+import { SchemaItem } from '../utils/types';
+
+interface SchemaDelta {
+  op: 'created' | 'altered' | 'dropped' | 'resync';
+  schema?: string;
+  table?: string;
+  item?: SchemaItem;
+}
+
+// The backend caps streams per worker. A refused client loads /api/schema once, then retries
+// the stream after 30s, 60s and 120s before settling for that snapshot
+const STREAM_RETRY_MS = 30000;
+const STREAM_MAX_ATTEMPTS = 4;
+
+export const applySchemaDelta = (schemaData: SchemaItem[], delta: SchemaDelta): SchemaItem[] => {
+  const schemaId = `schema-${delta.schema}`;
+  const tableId = `table-${delta.schema}-${delta.table}`;
+  let schemaFound = false;
+
+  const updated = schemaData.map((schemaItem) => {
+    if (schemaItem.id !== schemaId) {
+      return schemaItem;
+    }
+    schemaFound = true;
+    const tables = schemaItem.children || [];
+    if (delta.op === 'dropped' || !delta.item) {
+      return { ...schemaItem, children: tables.filter((table) => table.id !== tableId) };
+    }
+    const exists = tables.some((table) => table.id === tableId);
+    return {
+      ...schemaItem,
+      children: exists
+        ? tables.map((table) => (table.id === tableId ? delta.item! : table))
+        : [...tables, delta.item],
+    };
+  });
+
+  if (!schemaFound && delta.op !== 'dropped' && delta.item) {
+    updated.push({ id: schemaId, label: delta.schema || '', children: [delta.item] });
+  }
+  return updated;
+};
+
+export const useSchemaStream = (enabled: boolean) => {
+  const [schemaData, setSchemaData] = useState<SchemaItem[]>([]);
+
+  const fetchSchema = useCallback(async () => {
+    try {
+      const res = await fetch('/api/schema', { credentials: 'include' });
+      if (!res.ok) {
+        throw new Error('Failed to fetch schema');
+      }
+      const data = await res.json();
+      setSchemaData(data);
+    } catch (err) {
+      console.error('Error fetching schema:', err);
+    }
+  }, []);
+
+  useEffect(() => {
+    if (!enabled) {
+      return;
+    }
+
+    let source: EventSource | null = null;
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
+    let stopped = false;
+    let attempts = 0;
+    let loaded = false;
+
+    const connect = () => {
+      source = new EventSource('/api/schema/stream', { withCredentials: true });
+
+      // Sent once per connection: the full schema, replacing whatever we had
+      source.addEventListener('snapshot', (event) => {
+        attempts = 0;
+        loaded = true;
+        setSchemaData(JSON.parse((event as MessageEvent).data));
+      });
+
+      source.addEventListener('schema', (event) => {
+        const delta: SchemaDelta = JSON.parse((event as MessageEvent).data);
+        if (delta.op === 'resync') {
+          // Deltas were lost; a new connection starts with a fresh snapshot
+          source?.close();
+          connect();
+          return;
+        }
+        setSchemaData((current) => applySchemaDelta(current, delta));
+      });
+
+      source.onerror = () => {
+        // EventSource reconnects by itself after a dropped stream, but gives up on an
+        // error status such as 503; fall back to a single plain fetch and back off
+        if (source?.readyState !== EventSource.CLOSED || stopped) {
+          return;
+        }
+        if (!loaded) {
+          loaded = true;
+          fetchSchema();
+        }
+        attempts += 1;
+        if (attempts < STREAM_MAX_ATTEMPTS) {
+          retryTimer = setTimeout(connect, STREAM_RETRY_MS * 2 ** (attempts - 1));
+        }
+      };
+    };
+
+    connect();
+
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      source?.close();
+    };
+  }, [enabled, fetchSchema]);
+
+  return { schemaData, fetchSchema };
+};
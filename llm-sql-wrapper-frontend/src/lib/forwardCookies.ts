@@ -0,0 +1,10 @@
+import { NextResponse } from 'next/server';
+
+// Headers.get('Set-Cookie') joins several cookies with ", ", which browsers can't split
+// apart, so copy them one by one (the backend may set the session and read_after_lsn together)
+export function forwardSetCookies(backendResponse: Response, response: NextResponse) {
+  for (const cookie of backendResponse.headers.getSetCookie()) {
+    response.headers.append('Set-Cookie', cookie);
+  }
+  return response;
+}
@@ -0,0 +1,129 @@
+import datetime
+import io
+import os
+import uuid
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import LLMSQLWrapper, QueueWriter, export_statement, export_text, postgres_type_to_arrow
+
+
+class FakeCursor:
+    def __init__(self, description, rows, batch):
+        self.description = description
+        self.rows = list(rows)
+        self.batch = batch
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement):
+        self.executed.append(statement)
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:self.batch], self.rows[self.batch:]
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, description, rows, batch=2):
+        self.cursor_obj = FakeCursor(description, rows, batch)
+
+    def cursor(self, name=None):
+        assert name, "exports must use a named (server-side) cursor"
+        return self.cursor_obj
+
+
+def column(name, type_code, precision=None, scale=None):
+    return (name, type_code, None, None, precision, scale, None)
+
+
+def collect(writer):
+    writer.finish()
+    return b''.join(writer)
+
+
+def run_export(method, description, rows, batch=2):
+    conn = FakeConnection(description, rows, batch)
+    writer = QueueWriter(maxsize=1000)
+    getattr(LLMSQLWrapper, method)(None, conn, 'SELECT 1', writer)
+    return collect(writer)
+
+
+def test_export_statement_strips_comments_and_semicolon():
+    assert export_statement("SELECT a FROM t; -- all rows\n") == "SELECT a FROM t"
+    assert export_statement("/* cte */ WITH x AS (SELECT 1 AS a) SELECT a FROM x;") == \
+        "WITH x AS (SELECT 1 AS a) SELECT a FROM x"
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT 1; DROP TABLE t",
+    "SELECT 1; COPY t TO STDOUT",
+    "DELETE FROM t",
+    "-- nothing but a comment",
+])
+def test_export_statement_rejects_anything_but_one_select(query):
+    with pytest.raises(ValueError):
+        export_statement(query)
+
+
+def test_export_text_never_raises():
+    assert export_text(memoryview(b'\x01\xff')) == '01ff'
+    assert export_text(datetime.timedelta(hours=1)) == '1:00:00'
+    assert export_text([uuid.UUID(int=1), b'\x02']) == '["00000000-0000-0000-0000-000000000001", "02"]'
+
+
+def test_numeric_keeps_precision():
+    arrow_type, convert = postgres_type_to_arrow(1700, 20, 4)
+    assert arrow_type == pa.decimal128(20, 4)
+    assert convert(Decimal('NaN')) is None
+    arrow_type, convert = postgres_type_to_arrow(1700)
+    assert arrow_type == pa.string()
+    assert convert(Decimal('12345678901234567890.123456789')) == '12345678901234567890.123456789'
+
+
+def test_parquet_export_of_types_without_native_mapping():
+    description = [
+        column('t', 1083), column('i', 1186), column('b', 17), column('ids', 2951),
+        column('amount', 1700, 12, 2), column('exact', 1700),
+    ]
+    rows = [
+        (datetime.time(9, 30), datetime.timedelta(days=1), b'\x00\x01', [uuid.UUID(int=1)],
+         Decimal('10.25'), Decimal('0.1000000000000000055511151231257827')),
+        (None, None, None, None, None, None),
+        (datetime.time(17, 0), datetime.timedelta(minutes=5), memoryview(b'\xff'), [],
+         Decimal('-3.50'), Decimal('1E+40')),
+    ]
+    table = pq.read_table(io.BytesIO(run_export('write_parquet', description, rows)))
+    assert table.num_rows == 3
+    assert table.column('t').to_pylist()[0] == datetime.time(9, 30)
+    assert table.column('i').to_pylist()[0] == '1 day, 0:00:00'
+    assert table.column('b').to_pylist() == [b'\x00\x01', None, b'\xff']
+    assert table.column('ids').to_pylist()[0] == '["00000000-0000-0000-0000-000000000001"]'
+    assert table.column('amount').to_pylist() == [Decimal('10.25'), None, Decimal('-3.50')]
+    assert table.column('exact').to_pylist()[0] == '0.1000000000000000055511151231257827'
+
+
+def test_parquet_conversion_error_is_raised_before_any_bytes_are_written():
+    conn = FakeConnection([column('n', 23)], [('not a number',)])
+    writer = QueueWriter(maxsize=1000)
+    with pytest.raises(ValueError, match="Column n"):
+        LLMSQLWrapper.write_parquet(None, conn, 'SELECT 1', writer)
+    assert writer.tell() == 0
+
+
+def test_csv_export_uses_named_cursor_and_writes_every_row(monkeypatch):
+    monkeypatch.setattr(app_module, 'EXPORT_CSV_BATCH_ROWS', 2)
+    rows = [(1, 'a,b', None), (2, 'line\nbreak', b'\x0a'), (3, 'x', memoryview(b'\x00'))]
+    output = run_export('write_csv', [column('id', 23), column('s', 25), column('b', 17)], rows)
+    assert output.decode() == 'id,s,b\r\n1,"a,b",\r\n2,"line\nbreak",0a\r\n3,x,00\r\n'
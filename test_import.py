@@ -0,0 +1,126 @@
+import io
+import os
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+from app import (
+    IMPORT_FORM_OVERHEAD_BYTES,
+    IMPORT_SAMPLE_BYTES,
+    LLMSQLWrapper,
+    MAX_IMPORT_BYTES,
+    QuotaExceededError,
+    QuotaReader,
+    app,
+    request_too_large,
+)
+
+
+class CopyCursor:
+    """Pulls the file like psycopg2's copy_expert, including how it reports read() errors."""
+
+    def __init__(self):
+        self.copied = b''
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, statement, file, size=8192):
+        while True:
+            try:
+                chunk = file.read(size)
+            except Exception:
+                raise psycopg2.extensions.QueryCanceledError("error in .read() call")
+            if not chunk:
+                break
+            self.copied += chunk
+        self.rowcount = self.copied.count(b'\n') - 1
+
+
+class CopyConnection:
+    def __init__(self):
+        self.cursor_obj = CopyCursor()
+        self.committed = False
+
+    def cursor(self):
+        return self.cursor_obj
+
+    def commit(self):
+        self.committed = True
+
+
+class Statement:
+    def as_string(self, conn):
+        return "COPY ..."
+
+
+def csv_wrapper(conn):
+    wrapper = LLMSQLWrapper.__new__(LLMSQLWrapper)
+
+    @contextmanager
+    def get_user_connection(username):
+        yield conn
+
+    wrapper.get_user_connection = get_user_connection
+    wrapper.prepare_import_table = lambda *args: True
+    wrapper.copy_statement = lambda *args, **kwargs: Statement()
+    return wrapper
+
+
+def csv_upload(rows):
+    return io.BytesIO(b'id,name\n' + b''.join(b'%d,student %d\n' % (i, i) for i in range(rows)))
+
+
+def test_reader_records_that_the_limit_was_exceeded():
+    reader = QuotaReader(b'abc', io.BytesIO(b'defgh'), limit=6)
+    assert reader.read(4) == b'abc'
+    assert not reader.exceeded
+    with pytest.raises(QuotaExceededError):
+        reader.read(4)
+    assert reader.exceeded
+
+
+def test_csv_within_the_limit_is_copied():
+    conn = CopyConnection()
+    upload = csv_upload(100)
+    size = len(upload.getvalue())
+    result = csv_wrapper(conn).import_csv('alice', 'people', upload, size)
+    assert result["rows"] == 100
+    assert conn.cursor_obj.copied == upload.getvalue()
+    assert conn.committed
+
+
+def test_over_limit_csv_raises_quota_error_not_query_canceled():
+    conn = CopyConnection()
+    upload = csv_upload(20000)
+    assert len(upload.getvalue()) > IMPORT_SAMPLE_BYTES
+    with pytest.raises(QuotaExceededError):
+        csv_wrapper(conn).import_csv('alice', 'people', upload, IMPORT_SAMPLE_BYTES + 1000)
+    assert not conn.committed
+
+
+def test_unrelated_copy_errors_are_not_reported_as_quota():
+    conn = CopyConnection()
+
+    def failing_copy(statement, file):
+        raise psycopg2.DataError("invalid input syntax for type integer")
+
+    conn.cursor_obj.copy_expert = failing_copy
+    with pytest.raises(psycopg2.DataError):
+        csv_wrapper(conn).import_csv('alice', 'people', csv_upload(10), 10 ** 6)
+
+
+def test_oversized_request_body_gets_a_json_413():
+    assert app.config['MAX_CONTENT_LENGTH'] == MAX_IMPORT_BYTES + IMPORT_FORM_OVERHEAD_BYTES
+    with app.test_request_context():
+        response, status = request_too_large(RequestEntityTooLarge())
+    assert status == 413
+    assert "upload limit" in response.get_json()["error"]
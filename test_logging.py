@@ -0,0 +1,72 @@
+import logging
+import os
+import queue
+import sys
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import (
+    DeferredQueueHandler,
+    JSONLogFormatter,
+    LogPayload,
+    PayloadSampler,
+    RouteLevelFilter,
+    app,
+    parse_log_level,
+)
+
+
+def make_record(msg="message %s", args=(), level=logging.INFO, exc_info=None):
+    return logging.LogRecord('test', level, __file__, 1, msg, args, exc_info)
+
+
+def test_level_names_and_numbers_are_parsed():
+    assert parse_log_level('LOG_LEVEL', 'debug') == logging.DEBUG
+    assert parse_log_level('LOG_LEVEL', ' WARNING ') == logging.WARNING
+    assert parse_log_level('LOG_LEVEL', '15') == 15
+
+
+def test_invalid_level_falls_back_to_info_with_a_warning(monkeypatch):
+    monkeypatch.setattr(app_module, 'log_setting_errors', [])
+    assert parse_log_level('LOG_ROUTE_LEVELS', 'VERBOSE') == logging.INFO
+    assert app_module.log_setting_errors == ["Invalid log level 'VERBOSE' in LOG_ROUTE_LEVELS, using INFO"]
+
+
+def test_route_levels_apply_per_endpoint(monkeypatch):
+    monkeypatch.setattr(app_module, 'LOG_LEVEL', logging.WARNING)
+    monkeypatch.setattr(app_module, 'LOG_ROUTE_LEVELS', {'check_auth': logging.DEBUG})
+    route_filter = RouteLevelFilter()
+    with app.test_request_context('/check-auth'):
+        assert route_filter.filter(make_record(level=logging.DEBUG))
+    with app.test_request_context('/'):
+        assert not route_filter.filter(make_record(level=logging.INFO))
+        assert route_filter.filter(make_record(level=logging.ERROR))
+
+
+def test_sampled_out_payloads_are_replaced_but_records_kept(monkeypatch):
+    monkeypatch.setattr(app_module, 'LOG_PAYLOAD_SAMPLE_RATE', 0.0)
+    sampler = PayloadSampler()
+    record = make_record("rows %s, small %s", (LogPayload(list(range(100))), LogPayload([1])))
+    assert sampler.filter(record)
+    assert record.getMessage() == "rows <payload sampled out>, small [1]"
+    assert sampler.sampled_out == 1
+
+
+def test_prepare_snapshots_payloads_and_renders_tracebacks():
+    handler = DeferredQueueHandler(queue.Queue())
+    rows = [{"id": i} for i in range(50)]
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        record = make_record("rows %s", (LogPayload(rows),), exc_info=sys.exc_info())
+    prepared = handler.prepare(record)
+    rows[0]["id"] = "changed"
+    rows.append({"id": "late"})
+    assert prepared is not record
+    assert prepared.exc_info is None
+    assert "RuntimeError: boom" in prepared.exc_text
+    message = prepared.getMessage()
+    assert message.startswith("rows [{'id': 0}, {'id': 1}")
+    assert message.endswith("... [30 more items]")
+    assert '"exception": "Traceback' in JSONLogFormatter().format(prepared)
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import PasswordHasher, PasswordHasherBusyError, password_method_prefix
+
+
+@pytest.mark.parametrize("method", [
+    "scrypt", "scrypt:16384:8:1", "pbkdf2", "pbkdf2:sha512", "pbkdf2:sha256:600000",
+])
+def test_prefix_matches_what_werkzeug_stores(method):
+    assert password_method_prefix(method) == generate_password_hash('secret', method).split('$', 1)[0]
+
+
+def test_needs_rehash_never_hashes(monkeypatch):
+    hasher = PasswordHasher('pbkdf2:sha256:600000', processes=0, queue_depth=1)
+    monkeypatch.setattr(app_module, 'generate_password_hash', lambda *args: pytest.fail("hashed inline"))
+    assert not hasher.needs_rehash('pbkdf2:sha256:600000$salt$hash')
+    assert hasher.needs_rehash('pbkdf2:sha256:260000$salt$hash')
+    assert hasher.needs_rehash('scrypt:32768:8:1$salt$hash')
+
+
+def test_logins_beyond_the_queue_bound_are_refused():
+    hasher = PasswordHasher('pbkdf2:sha256:1000', processes=0, queue_depth=1)
+    password_hash = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+
+    def verify_while_busy(password_hash, password):
+        with pytest.raises(PasswordHasherBusyError):
+            hasher.verify(password_hash, password)
+        return True
+
+    assert hasher.run('verified', verify_while_busy, password_hash, 'secret')
+    assert hasher.counts['rejected'] == 1
+    assert hasher.verify(password_hash, 'secret')
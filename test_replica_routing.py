@@ -0,0 +1,90 @@
+import os
+import time
+
+import pytest
+from flask import Response, g
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import READ_AFTER_COOKIE, LLMSQLWrapper, ReplicaRouter, app, lsn_to_int, record_user_write
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ReplicaRouter({'host': 'primary', 'port': '5432'}, ['replica1:5432', 'replica2:5432'])
+    for replica in router.replicas:
+        replica['checked_at'] = time.monotonic()
+        replica['lag'] = 0.5
+    monkeypatch.setattr(router, 'check_lag', lambda replica: pytest.fail("lag sampled too often"))
+    return router
+
+
+def routing_wrapper(router):
+    wrapper = LLMSQLWrapper.__new__(LLMSQLWrapper)
+    wrapper.replica_router = router
+    wrapper.write_position = lambda: '0/3000060'
+    return wrapper
+
+
+def test_lsn_text_orders_numerically():
+    assert lsn_to_int('0/16B3748') == 0x16B3748
+    assert lsn_to_int('1/0') > lsn_to_int('0/FFFFFFFF')
+
+
+def test_any_replica_serves_a_client_without_recent_writes(router):
+    assert router.choose(None) in router.replicas
+
+
+def test_only_replicas_past_the_write_are_chosen(router):
+    router.replicas[0]['replay_lsn'] = lsn_to_int('0/2000000')
+    router.replicas[1]['replay_lsn'] = lsn_to_int('0/3000060')
+    for _ in range(4):
+        assert router.choose(lsn_to_int('0/3000060')) is router.replicas[1]
+
+
+def test_primary_when_every_replica_is_behind_the_write(router):
+    for replica in router.replicas:
+        replica['replay_lsn'] = lsn_to_int('0/2000000')
+    assert router.choose(lsn_to_int('0/3000060')) is None
+    assert router.reads['read_your_writes'] == 1
+
+
+def test_primary_within_the_writing_request(router):
+    assert router.choose(float('inf')) is None
+
+
+def test_lagging_replicas_are_skipped_whatever_their_position(router):
+    for replica in router.replicas:
+        replica['lag'] = 60
+    assert router.choose(None) is None
+    assert router.reads['lagging'] == 1
+
+
+def test_read_position_comes_from_the_cookie_without_a_query(router):
+    wrapper = routing_wrapper(router)
+    with app.test_request_context(headers={'Cookie': f'{READ_AFTER_COOKIE}=0/3000060'}):
+        assert wrapper.read_position() == lsn_to_int('0/3000060')
+    with app.test_request_context(headers={'Cookie': f'{READ_AFTER_COOKIE}=garbage'}):
+        assert wrapper.read_position() is None
+    with app.test_request_context():
+        assert wrapper.read_position() is None
+        g.user_wrote = True
+        assert wrapper.read_position() == float('inf')
+
+
+def test_writing_request_sets_the_cookie(router, monkeypatch):
+    monkeypatch.setattr(app_module, 'wrapper', routing_wrapper(router))
+    with app.test_request_context():
+        g.user_wrote = True
+        response = record_user_write(Response())
+    cookie = response.headers['Set-Cookie']
+    assert cookie.startswith(f'{READ_AFTER_COOKIE}=0/3000060')
+    assert 'HttpOnly' in cookie and 'Max-Age=' in cookie
+
+
+def test_reading_request_sets_no_cookie(router, monkeypatch):
+    monkeypatch.setattr(app_module, 'wrapper', routing_wrapper(router))
+    with app.test_request_context():
+        response = record_user_write(Response())
+    assert 'Set-Cookie' not in response.headers
@@ -0,0 +1,57 @@
+import os
+import queue
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import app
+
+
+class FakeFeed:
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, username):
+        subscriber = queue.Queue()
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, username, subscriber):
+        self.subscribers.remove(subscriber)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    feed = FakeFeed()
+    fake_wrapper = SimpleNamespace(schema_feed=feed, get_schema=lambda username: [{"id": "schema-public"}])
+    monkeypatch.setattr(app_module, 'wrapper', fake_wrapper)
+    monkeypatch.setattr(app_module, 'current_user', SimpleNamespace(username='alice', is_authenticated=True))
+    monkeypatch.setattr(app_module, 'schema_stream_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setitem(app.config, 'LOGIN_DISABLED', True)
+    with app.test_client() as client:
+        client.feed = feed
+        yield client
+
+
+def test_stream_starts_with_a_snapshot_and_frees_its_slot_on_close(client):
+    response = client.get('/schema/stream', buffered=False)
+    assert response.status_code == 200
+    first = next(response.response)
+    assert first.startswith(b'retry: 5000\nevent: snapshot\n')
+    assert len(client.feed.subscribers) == 1
+    response.close()
+    assert client.feed.subscribers == []
+    assert app_module.schema_stream_slots.acquire(blocking=False)
+
+
+def test_streams_beyond_the_worker_cap_are_refused(client):
+    open_stream = client.get('/schema/stream', buffered=False)
+    refused = client.get('/schema/stream')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '30'
+    open_stream.close()
+    assert client.get('/schema/stream', buffered=False).status_code == 200
@@ -0,0 +1,78 @@
+import os
+
+import psycopg2
+import pytest
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import LLMSQLWrapper, is_transaction_control
+
+
+class ScriptCursor:
+    """Records what reaches the server; any SQL mentioning 'boom' fails like a bad statement."""
+
+    def __init__(self):
+        self.executed = []
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if 'boom' in sql:
+            raise psycopg2.ProgrammingError('relation "boom" does not exist')
+        self.rowcount = 1 if sql.startswith('INSERT') else -1
+
+
+def run_script(statements):
+    cur = ScriptCursor()
+    results = LLMSQLWrapper.__new__(LLMSQLWrapper).execute_script(cur, statements, 'alice')
+    return cur, results
+
+
+@pytest.mark.parametrize("stmt", [
+    "ABORT", "abort;", "BEGIN", "START TRANSACTION", "COMMIT", "END", "ROLLBACK",
+    "SAVEPOINT s", "RELEASE s", "PREPARE TRANSACTION 'tx'", "COMMIT PREPARED 'tx'",
+    "ROLLBACK PREPARED 'tx'", "-- finish up\nCOMMIT",
+])
+def test_transaction_control_is_detected(stmt):
+    assert is_transaction_control(stmt)
+
+
+@pytest.mark.parametrize("stmt", [
+    "PREPARE fetch_one AS SELECT 1", "INSERT INTO t VALUES (1)", "UPDATE t SET ended = true",
+])
+def test_other_statements_are_not_transaction_control(stmt):
+    assert not is_transaction_control(stmt)
+
+
+def test_abort_is_refused_and_never_batched():
+    cur, results = run_script(["INSERT INTO t VALUES (1)", "ABORT", "INSERT INTO t VALUES (2)"])
+    assert not any('ABORT' in sql for sql in cur.executed)
+    assert [result["type"] for result in results] == ["message", "error", "message"]
+    assert results[1]["statement"] == 1
+
+
+def test_batch_reports_every_statement_and_the_last_row_count(monkeypatch):
+    monkeypatch.setattr(app_module, 'SCRIPT_BATCH_SIZE', 3)
+    statements = [f"INSERT INTO t VALUES ({i})" for i in range(3)]
+    cur, results = run_script(statements)
+    assert cur.executed == [
+        "SAVEPOINT script_batch",
+        ";\n".join(statements) + ";",
+        "RELEASE SAVEPOINT script_batch",
+    ]
+    assert [result["statement"] for result in results] == [0, 1, 2]
+    assert all(result["batch_size"] == 3 and "batch_elapsed_ms" in result for result in results)
+    assert results[0]["content"] == "Statement executed (batch of 3)"
+    assert results[2]["content"] == "1 rows affected"
+
+
+def test_failed_batch_is_replayed_one_statement_at_a_time():
+    statements = ["INSERT INTO t VALUES (1)", "INSERT INTO boom VALUES (2)", "INSERT INTO t VALUES (3)"]
+    cur, results = run_script(statements)
+    assert "ROLLBACK TO SAVEPOINT script_batch" in cur.executed
+    assert [result["type"] for result in results] == ["message", "error", "message"]
+    assert [result["statement"] for result in results] == [0, 1, 2]
+    assert all("elapsed_ms" in result for result in results)
+    assert 'boom' in results[1]["content"]
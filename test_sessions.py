@@ -0,0 +1,93 @@
+import os
+
+from flask import Flask, session
+from flask_login import LoginManager, UserMixin, login_user, logout_user
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+from app import MemorySessionInterface
+
+
+class RecordingSessionInterface(MemorySessionInterface):
+    """Stands in for the Postgres store, remembering what was written and deleted."""
+
+    def __init__(self):
+        super().__init__(cache_size=100, cache_ttl=60)
+        self.rows = {}
+
+    def _fetch(self, sid):
+        return self.rows.get(sid)
+
+    def _persist(self, sid, data, expires_at):
+        self.rows[sid] = (data, expires_at)
+
+    def _remove(self, sid):
+        self.rows.pop(sid, None)
+
+
+class User(UserMixin):
+    id = 7
+
+
+def session_cookie(response):
+    cookies = [header for header in response.headers.getlist('Set-Cookie') if header.startswith('session=')]
+    return cookies[-1].split(';', 1)[0].split('=', 1)[1] if cookies else None
+
+
+def make_client():
+    interface = RecordingSessionInterface()
+    test_app = Flask(__name__)
+    test_app.secret_key = 'test'
+    test_app.session_interface = interface
+    login_manager = LoginManager(test_app)
+    login_manager.user_loader(lambda user_id: User() if user_id == '7' else None)
+
+    @test_app.route('/login')
+    def login():
+        session['theme'] = 'dark'
+        login_user(User())
+        return 'ok'
+
+    @test_app.route('/logout')
+    def logout():
+        logout_user()
+        return 'ok'
+
+    @test_app.route('/touch')
+    def touch():
+        session['visits'] = session.get('visits', 0) + 1
+        return 'ok'
+
+    return test_app.test_client(), interface
+
+
+def test_login_issues_a_new_sid_and_forgets_the_planted_one():
+    client, interface = make_client()
+    planted = session_cookie(client.get('/touch'))
+    assert planted in interface.rows
+
+    new_sid = session_cookie(client.get('/login'))
+    assert new_sid and new_sid != planted
+    assert planted not in interface.rows and interface.cache.get(planted) is None
+    data, _ = interface.rows[new_sid]
+    assert data['_user_id'] == '7' and data['visits'] == 1 and data['theme'] == 'dark'
+
+
+def test_logout_retires_the_authenticated_sid():
+    client, interface = make_client()
+    authenticated = session_cookie(client.get('/login'))
+    response = client.get('/logout')
+    assert authenticated not in interface.rows
+    assert interface.cache.get(authenticated) is None
+    after = session_cookie(response)
+    assert after != authenticated
+    if after:
+        assert '_user_id' not in interface.rows[after][0]
+
+
+def test_requests_without_auth_changes_keep_their_sid():
+    client, interface = make_client()
+    first = session_cookie(client.get('/touch'))
+    second = session_cookie(client.get('/touch'))
+    assert second in (None, first)
+    assert interface.rows[first][0]['visits'] == 2
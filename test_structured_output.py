@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+from app import (
+    LLMOutputError,
+    PRACTICE_QUESTION_FIELDS,
+    SOLUTION_FEEDBACK_FIELDS,
+    coerce_structured,
+    extract_practice_question_text,
+    extract_solution_feedback_text,
+    llm_parse_stats,
+    parse_structured_output,
+)
+
+FEEDBACK = {
+    "correctness_score": 8,
+    "correctness": "Returns the right rows.",
+    "efficiency_score": 7,
+    "efficiency": "Scans the table once.",
+    "style_score": 9,
+    "style": "Readable.",
+    "overall_feedback": "Good work.",
+    "improvement_suggestions": ["Alias the columns."],
+}
+
+LEGACY_QUESTION = """Question: Which products appear in more than 10 orders? Return rows like {"name": "Widget", "orders": 12}.
+Category: Aggregation
+Tables: products, orders
+Hint: Use GROUP BY with HAVING."""
+
+LEGACY_FEEDBACK = """Correctness (8/10): Returns the right rows.
+Efficiency (7/10): Scans the table once.
+Style (9/10): Readable.
+
+Overall feedback: Good work.
+
+Improvement suggestions:
+- Alias the columns."""
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    llm_parse_stats.clear()
+
+
+def test_strict_json_is_returned_unchanged():
+    reply = '{"question": "Q?", "category": "Joins", "tables": "orders", "hint": "H"}'
+    data = parse_structured_output(reply, PRACTICE_QUESTION_FIELDS, 'practice_question')
+    assert data == {"question": "Q?", "category": "Joins", "tables": "orders", "hint": "H"}
+    assert llm_parse_stats['practice_question']['strict'] == 1
+
+
+def test_fenced_json_with_trailing_comma_is_repaired():
+    reply = 'Here you go:\n```json\n{"question": "Q?", "category": "Joins", "tables": "orders", "hint": "H",}\n```'
+    data = parse_structured_output(reply, PRACTICE_QUESTION_FIELDS, 'practice_question')
+    assert data["hint"] == "H"
+    assert llm_parse_stats['practice_question']['repaired'] == 1
+
+
+def test_scores_and_lists_are_coerced():
+    data = coerce_structured(
+        {**FEEDBACK, "Correctness Score": "8/10", "efficiency_score": 7.0, "improvement_suggestions": "- One\n- Two"},
+        SOLUTION_FEEDBACK_FIELDS,
+    )
+    assert data["correctness_score"] == 8
+    assert data["efficiency_score"] == 7
+    assert data["improvement_suggestions"] == ["One", "Two"]
+
+
+def test_legacy_reply_containing_braces_falls_back_to_text_layout():
+    data = parse_structured_output(
+        LEGACY_QUESTION, PRACTICE_QUESTION_FIELDS, 'practice_question', extract_practice_question_text
+    )
+    assert data["category"] == "Aggregation"
+    assert data["tables"] == "products, orders"
+    assert data["question"].startswith("Which products")
+
+
+def test_legacy_feedback_text_is_parsed():
+    data = parse_structured_output(
+        LEGACY_FEEDBACK, SOLUTION_FEEDBACK_FIELDS, 'solution_feedback', extract_solution_feedback_text
+    )
+    assert data["correctness_score"] == 8
+    assert data["style"] == "Readable."
+    assert data["improvement_suggestions"] == ["Alias the columns."]
+
+
+def test_extractors_return_none_for_unrelated_text():
+    assert extract_practice_question_text("I cannot help with that.") is None
+    assert extract_solution_feedback_text("I cannot help with that.") is None
+
+
+def test_out_of_range_score_is_rejected():
+    reply = '{"correctness_score": 12}'
+    with pytest.raises(LLMOutputError) as excinfo:
+        parse_structured_output(reply, SOLUTION_FEEDBACK_FIELDS, 'solution_feedback')
+    assert "'correctness_score' must be between 0 and 10" in excinfo.value.problems
+    assert "missing field 'style'" in excinfo.value.problems
+    assert llm_parse_stats['solution_feedback']['invalid'] == 1
+
+
+def test_reply_without_json_or_legacy_layout_fails():
+    with pytest.raises(LLMOutputError) as excinfo:
+        parse_structured_output(
+            "Sorry, no.", PRACTICE_QUESTION_FIELDS, 'practice_question', extract_practice_question_text
+        )
+    assert excinfo.value.problems == ["reply did not contain a JSON object"]
+
+
+def test_unusable_reply_is_not_a_client_error():
+    assert not issubclass(LLMOutputError, ValueError)
@@ -0,0 +1,91 @@
+import os
+import threading
+
+import pytest
+from psycopg2.pool import PoolError
+
+os.environ.setdefault('SESSION_TYPE', 'memory')
+
+import app as app_module
+from app import UserConnectionPool
+
+
+class FakeConnection:
+    def __init__(self, username):
+        self.username = username
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def make_pool(max_connections):
+    opened = []
+
+    def connect(username, replica):
+        conn = FakeConnection(username)
+        opened.append(conn)
+        return conn
+
+    return UserConnectionPool(connect, max_connections), opened
+
+
+def use(pool, username):
+    with pool.connection(username) as conn:
+        return conn
+
+
+def test_each_user_gets_their_own_connection_back():
+    pool, opened = make_pool(4)
+    first = {username: use(pool, username) for username in ('alice', 'bob', 'carol')}
+    for _ in range(5):
+        for username in ('alice', 'bob', 'carol'):
+            assert use(pool, username) is first[username]
+    assert len(opened) == 3
+    assert pool.stats()["hit_rate"] == pytest.approx(15 / 18, abs=0.001)
+
+
+def test_least_recently_used_user_is_evicted_when_full():
+    pool, opened = make_pool(2)
+    alice, bob = use(pool, 'alice'), use(pool, 'bob')
+    use(pool, 'alice')
+    carol = use(pool, 'carol')
+    assert bob.closed and not alice.closed
+    assert use(pool, 'alice') is alice
+    assert use(pool, 'carol') is carol
+    assert pool.counts['evicted'] == 1
+    assert pool.open_connections == 2
+
+
+def test_checkout_times_out_when_every_connection_is_busy(monkeypatch):
+    monkeypatch.setattr(app_module, 'DB_POOL_TIMEOUT', 0.05)
+    pool, _ = make_pool(1)
+    busy = pool.checkout('alice')
+    with pytest.raises(PoolError):
+        pool.checkout('bob')
+    pool.release(busy, 'alice')
+    assert use(pool, 'bob').username == 'bob'
+
+
+def test_concurrent_users_never_exceed_the_limit():
+    pool, opened = make_pool(3)
+    peak = []
+
+    def work(username):
+        for _ in range(100):
+            with pool.connection(username):
+                peak.append(pool.open_connections)
+
+    threads = [threading.Thread(target=work, args=(username,)) for username in 'abcdabcd']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 3
+    assert pool.open_connections == sum(len(idle) for idle in pool.idle.values())